@@ -0,0 +1,321 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable
+
+import redis.asyncio as redis
+from sqlalchemy import inspect
+
+from app.logs import logger
+from app.config import settings
+
+
+# field of a cached hash that marks "there is no row with such key"
+MISSING = '__missing__'
+
+# workers announce changed keys here, so everyone drops them from near cache
+INVALIDATION_CHANNEL = 'row-cache:invalidate'
+
+# caches a row read from the database only if nobody has cached it meanwhile,
+# so a stale read never replaces a row that was just written
+POPULATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+class NearCache:
+    """
+    In-process LRU in front of Redis, limited by total size of entries in bytes.
+    Entries are dropped when other workers announce changes (see `listen_invalidations`),
+    `ttl` is only a safety net for missed messages.
+    Stays disabled until the invalidation listener is subscribed
+    """
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = False
+        self.size = 0
+
+        # grows with every announced change, values read from Redis
+        # before a change are not put (see `put`)
+        self.generation = 0
+
+        # key -> (values, size in bytes, expiration time)
+        self._entries: OrderedDict[str, tuple[dict | None, int, float]] = OrderedDict()
+
+
+    def get(self, key: str) -> tuple[bool, dict | None]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        values, _, expires = entry
+        if expires < time.monotonic():
+            self.discard(key)
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, values
+
+
+    def put(self, key: str, values: dict | None, size: int, generation: int | None = None) -> None:
+        """
+        With `generation` (taken before reading `values`) the entry is put
+        only if no change was announced since then
+        """
+        if not self.enabled or size > self.max_bytes:
+            return
+
+        if generation is not None and generation != self.generation:
+            return
+
+        self.discard(key)
+        self._entries[key] = (values, size, time.monotonic() + self.ttl)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+
+    def discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+    def invalidate(self, key: str) -> None:
+        self.generation += 1
+        self.discard(key)
+
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+        self.size = 0
+
+
+near_cache = NearCache(settings.NEAR_CACHE_MAX_BYTES, settings.NEAR_CACHE_TTL)
+
+# other in-process caches that want to hear about announced keys,
+# '*' means everything has to be dropped
+invalidation_hooks: list[Callable[[str], None]] = []
+
+
+async def publish_invalidation(redis_client: redis.Redis, key: str) -> None:
+    try:
+        await redis_client.publish(INVALIDATION_CHANNEL, key)
+    except redis.RedisError:
+        logger.warning('Failed to announce cache invalidation', key=key)
+
+
+async def listen_invalidations(redis_client: redis.Redis) -> None:
+    """
+    Drops keys announced by any worker from the near cache.
+    Runs for the whole life of the process, resubscribes after connection errors
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                near_cache.enabled = True
+
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        key = message['data'].decode()
+                        near_cache.invalidate(key)
+
+                        for hook in invalidation_hooks:
+                            hook(key)
+
+        except redis.RedisError:
+            logger.warning('Lost row cache invalidation channel, near cache is cleared')
+        finally:
+            # changes made while unsubscribed were not seen
+            near_cache.enabled = False
+            near_cache.clear()
+
+            for hook in invalidation_hooks:
+                hook('*')
+
+        await asyncio.sleep(1)
+
+
+class RowCache:
+    """
+    Caches rows of one model by primary key in Redis hashes.
+    Every column is a field of the hash: bytes are stored as they are,
+    other values as JSON. Absence of a row is cached too (negative caching).
+    Decoded rows are also kept in the in-process `near_cache`
+    """
+    def __init__(self, model, redis_client: redis.Redis, ttl: int, negative_ttl: int):
+        self.model = model
+        self.redis = redis_client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.prefix = f'row:{model.__tablename__}:'
+
+        self.near_hits = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+        self._populate = redis_client.register_script(POPULATE_SCRIPT)
+
+
+    def stats(self) -> dict:
+        return {
+            'near_hits': self.near_hits,
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+        }
+
+
+    def _encode(self, instance) -> dict:
+        state = inspect(instance)
+        mapping = {}
+
+        for attribute in state.mapper.column_attrs:
+            # e.g. server defaults that were not loaded after insert
+            if attribute.key in state.unloaded:
+                continue
+
+            value = getattr(instance, attribute.key)
+            if value is None:
+                continue
+
+            if isinstance(value, bytes):
+                mapping[attribute.key] = value
+            elif isinstance(value, datetime):
+                mapping[attribute.key] = value.isoformat()
+            else:
+                mapping[attribute.key] = json.dumps(value)
+
+        return mapping
+
+
+    def _decode(self, mapping: dict) -> dict:
+        values = {}
+
+        for attribute in inspect(self.model).column_attrs:
+            value = mapping.get(attribute.key.encode())
+            if value is None:
+                continue
+
+            python_type = attribute.columns[0].type.python_type
+            if python_type is bytes:
+                values[attribute.key] = value
+            elif python_type is datetime:
+                values[attribute.key] = datetime.fromisoformat(value.decode())
+            else:
+                values[attribute.key] = json.loads(value)
+
+        return values
+
+
+    async def get(self, id) -> tuple[bool, object]:
+        """
+        Returns (found in cache, instance or None)
+        """
+        key = self.prefix + str(id)
+
+        found, values = near_cache.get(key)
+        if found:
+            self.near_hits += 1
+            return True, None if values is None else self.model(**values)
+
+        generation = near_cache.generation
+        try:
+            mapping = await self.redis.hgetall(key)
+        except redis.RedisError:
+            logger.warning('Row cache is unavailable', table=self.model.__tablename__)
+            mapping = {}
+
+        if not mapping:
+            self.misses += 1
+            return False, None
+
+        size = sum(len(field) + len(value) for field, value in mapping.items())
+
+        if MISSING.encode() in mapping:
+            self.negative_hits += 1
+            near_cache.put(key, None, size, generation)
+            return True, None
+
+        self.hits += 1
+        values = self._decode(mapping)
+        near_cache.put(key, values, size, generation)
+
+        return True, self.model(**values)
+
+
+    def _entry(self, instance) -> tuple[dict, int]:
+        if instance is None:
+            return {MISSING: 1}, self.negative_ttl
+
+        return self._encode(instance), self.ttl
+
+
+    async def populate(self, id, instance) -> None:
+        """
+        Caches a row (or its absence) just read from the database,
+        unless the key is already cached (e.g. by a write that committed meanwhile)
+        """
+        key = self.prefix + str(id)
+        mapping, ttl = self._entry(instance)
+
+        try:
+            await self._populate(
+                keys=[key],
+                args=[ttl, *(item for pair in mapping.items() for item in pair)],
+            )
+        except redis.RedisError:
+            logger.warning('Row cache is unavailable', table=self.model.__tablename__)
+
+
+    async def store(self, id, instance, publish: bool = False) -> None:
+        """
+        Caches a row (or its absence if `instance` is None), replacing the cached one.
+        With `publish` other workers drop their near cache entry,
+        it is needed when the row has just been written
+        """
+        await self.store_many({id: instance}, publish=publish)
+
+
+    async def store_many(self, instances: dict, publish: bool = False) -> None:
+        """
+        Same as `store` for {id: instance or None} in one round trip.
+        Deleted rows are cached as absent rather than dropped,
+        so a read that started before the delete cannot cache them again
+        """
+        if not instances:
+            return
+
+        keys = [self.prefix + str(id) for id in instances]
+
+        # this worker must not serve the old row until its own announcement comes back,
+        # reads already in flight must not put it back either
+        for key in keys:
+            near_cache.invalidate(key)
+
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for key, instance in zip(keys, instances.values()):
+                    mapping, ttl = self._entry(instance)
+                    pipe.delete(key)
+                    pipe.hset(key, mapping=mapping)
+                    pipe.expire(key, ttl)
+                    if publish:
+                        pipe.publish(INVALIDATION_CHANNEL, key)
+                await pipe.execute()
+        except redis.RedisError:
+            logger.warning('Row cache is unavailable', table=self.model.__tablename__)
@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,13 +14,110 @@ class Settings(BaseSettings):
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
 
+    # connection pool of every process (web and Celery workers have their own),
+    # peak connections are processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 30 * 60
+    DB_POOL_PRE_PING: bool = True
+    # prepared statements kept by every connection, 0 turns them off (e.g. behind pgbouncer)
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+
     # Redis
+    REDIS_HOST: str = 'localhost'
     REDIS_PORT: int
+    # requests wait up to REDIS_POOL_TIMEOUT seconds for a free connection
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 5
+
+    # Celery uses its own Redis databases as broker and result backend
+    CELERY_BROKER_DB: int = 1
+    CELERY_RESULT_DB: int = 2
+    CELERY_RESULT_TTL: int = 24 * 60 * 60
+
+    # rows read by primary key are cached in Redis for this many seconds
+    CACHE_TTL_SENTIMENTS: int = 60 * 60
+    CACHE_TTL_SUMMARIES: int = 60 * 60
+    CACHE_NEGATIVE_TTL: int = 30
+    # in-process cache in front of Redis, invalidated through Redis pub/sub
+    NEAR_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    NEAR_CACHE_TTL: int = 60
+
+    # Rate limiting: a request costs 1 unit plus 1 per RATE_LIMIT_UNIT_BYTES of body,
+    # every route has token buckets (per user or IP) of (capacity, units refilled per second)
+    RATE_LIMIT_UNIT_BYTES: int = 1000
+    RATE_LIMITS: dict[str, tuple[float, float]] = {
+        'default': (1, 1),
+        'sentiment': (200, 20),
+        'sentiment-batch': (2000, 50),
+        'summary': (100, 2),
+    }
+    # share of a bucket a worker may spend without asking Redis, 0 turns it off
+    RATE_LIMIT_LOCAL_SHARE: float = 0.1
 
     # Encryption passwords
     SECRET_KEY: str
     ALGORITHM: str
 
+    # bcrypt cost factor and how many hashes may be computed at once
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_CONCURRENCY: int = 4
+
+    # users of recently seen tokens are kept in memory for this many seconds
+    AUTH_USER_CACHE_TTL: int = 30
+    AUTH_USER_CACHE_SIZE: int = 10_000
+    # put profile into tokens, so requests need no database to authenticate;
+    # changes of the profile reach such tokens only when they are reissued
+    AUTH_TOKEN_CLAIMS: bool = False
+
+    # Sentiment inference
+    # `onnx` backends need `python -m app.sentiments.export` to be run first
+    SENTIMENT_BACKEND: Literal['torch', 'onnx', 'onnx-int8'] = 'torch'
+    SENTIMENT_ONNX_DIR: Path = ROOT_DIR / 'models' / 'sentiment'
+    SENTIMENT_BATCH_SIZE: int = 64
+    SENTIMENT_BATCH_WAIT_MS: int = 10
+    # sentences per chunk of the streaming endpoint
+    SENTIMENT_STREAM_CHUNK: int = 8
+
+    # 0 means "pick from the number of cores"
+    INFERENCE_WORKERS: int = 0
+    INFERENCE_THREADS_PER_WORKER: int = 0
+    # sentences waiting for the model, 0 means 4 full batches per worker
+    INFERENCE_MAX_PENDING: int = 0
+    # load the model in every worker process on startup,
+    # otherwise it is loaded by the first request or call of `/ready`
+    INFERENCE_WARMUP: bool = True
+
+    # scores of already seen sentences, Redis tier is shared between workers
+    SENTENCE_CACHE_SIZE: int = 100_000
+    SENTENCE_CACHE_REDIS: bool = False
+    SENTENCE_CACHE_TTL: int = 7 * 24 * 60 * 60
+
+    # `array` keeps scores as float8[], others pack them into bytea
+    SENTIMENT_SCORES_ENCODING: Literal['array', 'float32', 'int8'] = 'array'
+
+    # rendered graphs of sentiment analyses
+    SENTIMENT_GRAPH_TTL: int = 24 * 60 * 60
+
+    # Summarization LLM served by Ollama
+    OLLAMA_HOST: str = 'http://localhost:11434'
+    OLLAMA_MODEL: str = 'gemma3'
+    OLLAMA_TIMEOUT: float = 300
+    # generations one process runs at once, others wait for a slot
+    OLLAMA_CONCURRENCY: int = 4
+
+    # long texts are split into chunks of about this many tokens, summarized
+    # (at most SUMMARY_MAP_CONCURRENCY chunks of a text at once) and then combined
+    SUMMARY_CHUNK_TOKENS: int = 1500
+    SUMMARY_MAP_CONCURRENCY: int = 4
+    # sentences in summaries of `extractive` mode
+    SUMMARY_EXTRACTIVE_SENTENCES: int = 5
+
+    # summaries shared by all users, by model, prompt version and text
+    SUMMARY_CACHE_TTL: int = 7 * 24 * 60 * 60
+    SUMMARY_CACHE_MAX_ENTRIES: int = 100_000
+
     model_config = SettingsConfigDict(
         env_file = ROOT_DIR / '.env',
     )
@@ -35,6 +133,10 @@ def get_db_url():
     )
 
 
+def get_redis_url(db: int = 0):
+    return f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/{db}'
+
+
 def get_auth_data():
     return {
         'secret_key': settings.SECRET_KEY,
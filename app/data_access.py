@@ -1,52 +1,236 @@
-from sqlalchemy import select, update, delete
-from sqlalchemy.exc import SQLAlchemyError
+import hashlib
+from functools import partial
 
-from app.database import async_session_maker
+from sqlalchemy import select, update, delete, inspect
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+
+from app.database import unit_of_work, after_commit, has_pending_writes
+from app.cache import RowCache
+from app.redis import r
+from app.config import settings
+
+
+def get_text_digest(text: str) -> str:
+    """
+    sha256 of the exact text (utf-8), the same value Postgres gets with
+    encode(sha256(convert_to(text, 'UTF8')), 'hex')
+    """
+    return hashlib.sha256(text.encode()).hexdigest()
 
 
 class BaseDA:
     model = None
 
+    # unique key checked by INSERT ... ON CONFLICT of `get_or_create` and `bulk_upsert`,
+    # empty means any unique constraint (`bulk_upsert` needs an explicit key)
+    conflict_columns: tuple[str, ...] = ()
+
+    # seconds to keep rows read by primary key in Redis, None turns caching off
+    cache_ttl: int | None = None
+    # seconds to remember that there is no row with a given primary key
+    negative_cache_ttl: int = settings.CACHE_NEGATIVE_TTL
+
+    # public fields that are stored in other columns, e.g. computed properties,
+    # used to load only the columns of requested fields
+    field_columns: dict[str, tuple[str, ...]] = {}
+
+    _row_caches: dict = {}
+
+
+    @classmethod
+    def row_cache(cls) -> RowCache | None:
+        if cls.cache_ttl is None:
+            return None
+
+        if cls not in BaseDA._row_caches:
+            BaseDA._row_caches[cls] = RowCache(cls.model, r, cls.cache_ttl, cls.negative_cache_ttl)
+
+        return BaseDA._row_caches[cls]
+
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """
+        Hit and miss counters of every row cache of this process
+        """
+        return {da.model.__tablename__: cache.stats() for da, cache in BaseDA._row_caches.items()}
+
+
+    @classmethod
+    def _with_digest(cls, values: dict) -> dict:
+        """
+        For models that have `text_digest` column adds digest of `source_text`,
+        so lookups by text use the (user_id, text_digest) index
+        instead of comparing whole texts
+        """
+        if 'source_text' in values and hasattr(cls.model, 'text_digest'):
+            return values | {'text_digest': get_text_digest(values['source_text'])}
+
+        return values
+
 
     @classmethod
-    async def get(cls, **filter_by):
-        async with async_session_maker() as session:
+    def _cache_after_commit(cls, session: AsyncSession, *instances) -> None:
+        """
+        Once committed, the written rows replace cached ones (or cached "no such row")
+        here and in other workers
+        """
+        cache = cls.row_cache()
+        if cache and instances:
+            entries = {instance.id: instance for instance in instances}
+            after_commit(session, partial(cache.store_many, entries, publish=True))
+
+
+    @classmethod
+    def _forget_after_commit(cls, session: AsyncSession, ids: list) -> None:
+        """
+        Once committed, deleted rows are cached as "no such row"
+        here and in other workers
+        """
+        cache = cls.row_cache()
+        if cache and ids:
+            after_commit(session, partial(cache.store_many, dict.fromkeys(ids), publish=True))
+
+
+    @classmethod
+    def _prepare_values(cls, values: dict) -> dict:
+        """
+        Turns values given by callers into column values on create and update
+        """
+        return cls._with_digest(values)
+
+
+    @classmethod
+    async def get(cls, session: AsyncSession | None = None, **filter_by):
+        filter_by = cls._with_digest(filter_by)
+
+        # lookups by primary key are read through the row cache,
+        # unless this unit of work has changed rows that are not committed yet
+        cache = cls.row_cache()
+        by_id = cache is not None and filter_by.keys() == {'id'} and not has_pending_writes(session)
+
+        if by_id:
+            found, instance = await cache.get(filter_by['id']) # type: ignore
+            if found:
+                return instance
+
+        async with unit_of_work(session) as session:
             query = select(cls.model).filter_by(**filter_by) # type: ignore
             result = await session.execute(query)
             instance = result.scalar_one_or_none()
+
+        if by_id:
+            # a row written meanwhile is already cached and is kept
+            await cache.populate(filter_by['id'], instance) # type: ignore
         
         return instance
     
 
     @classmethod
-    async def get_or_create(cls, **values):
-        instance = await cls.get(**values)
-        
-        if not instance:
-            instance = await cls.create(**values)
-        
+    async def get_or_create(cls, session: AsyncSession | None = None, **values):
+        """
+        Inserts a row with INSERT ... ON CONFLICT DO NOTHING on `conflict_columns`,
+        the existing row is selected only if the insert was skipped.
+        Concurrent calls with the same key get the same row
+        """
+        values = cls._prepare_values(values)
+
+        async with unit_of_work(session) as session:
+            query = (
+                insert(cls.model) # type: ignore
+                .on_conflict_do_nothing(index_elements=cls.conflict_columns or None)
+                .returning(cls.model)
+            )
+            instance = (await session.scalars(query, [values])).one_or_none()
+
+            if instance is None:
+                key = {column: values[column] for column in cls.conflict_columns} or values
+                query = select(cls.model).filter_by(**key) # type: ignore
+                return (await session.scalars(query)).one()
+
+            cls._cache_after_commit(session, instance)
+
         return instance
 
 
     @classmethod
-    async def create(cls, **values):
-        async with async_session_maker() as session:
-            async with session.begin():
-                new_instance = cls.model(**values) # type: ignore
-                session.add(new_instance)
-
-                try:
-                    await session.commit()
-                except SQLAlchemyError as e:
-                    await session.rollback()
-                    raise e
+    async def create(cls, session: AsyncSession | None = None, **values):
+        values = cls._prepare_values(values)
+
+        async with unit_of_work(session) as session:
+            new_instance = cls.model(**values) # type: ignore
+            session.add(new_instance)
+            await session.flush()
+
+            cls._cache_after_commit(session, new_instance)
         
         return new_instance
 
 
     @classmethod
-    async def filter(cls, **filter_by):
-        async with async_session_maker() as session:
+    async def bulk_upsert(cls, values: list[dict], session: AsyncSession | None = None) -> list[int]:
+        """
+        Inserts all rows with one multi-row INSERT ... ON CONFLICT DO UPDATE,
+        rows that already exist (same `conflict_columns`) are overwritten.
+        Returns ids in the order of `values`
+        """
+        if not values:
+            return []
+
+        values = [cls._prepare_values(row) for row in values]
+
+        async with unit_of_work(session) as session:
+            # values are keyed by attributes, SET clause needs column names
+            columns = [
+                inspect(cls.model).column_attrs[key].columns[0].name # type: ignore
+                for key in values[0] if key not in cls.conflict_columns
+            ]
+            query = insert(cls.model) # type: ignore
+            query = (
+                query
+                .on_conflict_do_update(
+                    index_elements=cls.conflict_columns,
+                    set_={column: query.excluded[column] for column in columns},
+                )
+                .returning(cls.model, sort_by_parameter_order=True) # type: ignore
+                .execution_options(populate_existing=True)
+            )
+            result = await session.scalars(query, values)
+            instances = list(result.all())
+            ids = [instance.id for instance in instances]
+
+            cls._cache_after_commit(session, *instances)
+
+        return ids
+
+
+    @classmethod
+    async def filter_in(cls, column: str, values: list, session: AsyncSession | None = None, **filter_by):
+        """
+        Finds rows whose `column` is one of `values` with a single query
+        """
+        if not values:
+            return []
+
+        async with unit_of_work(session) as session:
+            query = (
+                select(cls.model) # type: ignore
+                .filter_by(**filter_by)
+                .where(getattr(cls.model, column).in_(values))
+            )
+            result = await session.execute(query)
+            instances = result.scalars().all()
+
+        return instances
+
+
+    @classmethod
+    async def filter(cls, session: AsyncSession | None = None, **filter_by):
+        filter_by = cls._with_digest(filter_by)
+
+        async with unit_of_work(session) as session:
             query = select(cls.model).filter_by(**filter_by) # type: ignore
             result = await session.execute(query)
             instances = result.scalars().all()
@@ -55,40 +239,89 @@ class BaseDA:
 
 
     @classmethod
-    async def update(cls, filter_by: dict, **values):
-        async with async_session_maker() as session:
-            async with session.begin():
-                query = (
-                    update(cls.model) # type: ignore
-                    .where(
-                        *[getattr(cls.model, key) == value
-                        for key, value in filter_by.items()]
-                    )
-                    .values(**values)
-                    .execution_options(synchronize_session='fetch')
+    async def filter_page(
+        cls, 
+        after: int | None = None, 
+        limit: int = 100, 
+        fields: list[str] | None = None,
+        session: AsyncSession | None = None,
+        **filter_by,
+    ) -> list:
+        """
+        Bounded variant of `filter`: at most `limit` rows ordered by id, 
+        starting after id `after` (keyset pagination, so every page costs the same 
+        with a (filter columns, id) index). With `fields` only their columns are loaded,
+        other attributes of returned rows must not be accessed
+        """
+        filter_by = cls._with_digest(filter_by)
+
+        query = (
+            select(cls.model) # type: ignore
+            .filter_by(**filter_by)
+            .order_by(cls.model.id) # type: ignore
+            .limit(limit)
+        )
+        if after is not None:
+            query = query.where(cls.model.id > after) # type: ignore
+
+        if fields is not None:
+            columns = [
+                getattr(cls.model, column) 
+                for field in fields for column in cls.field_columns.get(field, (field,))
+            ]
+            query = query.options(load_only(cls.model.id, *columns)) # type: ignore
+
+        async with unit_of_work(session) as session:
+            result = await session.execute(query)
+            instances = result.scalars().all()
+
+        return instances
+
+
+    @classmethod
+    async def update(cls, filter_by: dict, session: AsyncSession | None = None, **values) -> list:
+        """
+        Updates rows with one UPDATE ... RETURNING, returns updated rows
+        """
+        filter_by = cls._with_digest(filter_by)
+        values = cls._prepare_values(values)
+
+        async with unit_of_work(session) as session:
+            query = (
+                update(cls.model) # type: ignore
+                .where(
+                    *[getattr(cls.model, key) == value
+                    for key, value in filter_by.items()]
                 )
-                result = await session.execute(query)
+                .values(**values)
+                .returning(cls.model)
+                .execution_options(synchronize_session='fetch')
+            )
+            result = await session.scalars(query)
+            instances = list(result.all())
 
-                try:
-                    await session.commit()
-                except SQLAlchemyError as e:
-                    await session.rollback()
-                    raise e
+            for instance in instances:
+                cls._cache_after_commit(session, instance)
 
-        return result.rowcount # type: ignore
+        return instances
 
 
     @classmethod
-    async def delete(cls, **filter_by):
-        async with async_session_maker() as session:
-            async with session.begin():
-                query = delete(cls.model).filter_by(**filter_by) # type: ignore
-                result = await session.execute(query)
-
-                try:
-                    await session.commit()
-                except SQLAlchemyError as e:
-                    await session.rollback()
-                    raise e
+    async def delete(cls, session: AsyncSession | None = None, **filter_by) -> list[int]:
+        """
+        Deletes rows with one DELETE ... RETURNING, returns ids of deleted rows
+        """
+        filter_by = cls._with_digest(filter_by)
+
+        async with unit_of_work(session) as session:
+            query = (
+                delete(cls.model) # type: ignore
+                .filter_by(**filter_by)
+                .returning(cls.model.id) # type: ignore
+            )
+            result = await session.scalars(query)
+            ids = list(result.all())
+
+            cls._forget_after_commit(session, ids)
                 
-        return result.rowcount # type: ignore
+        return ids
@@ -1,18 +1,185 @@
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Awaitable, Callable
 
-from sqlalchemy import func
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
+from sqlalchemy import func, event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import (
+    create_async_engine, 
+    async_sessionmaker, 
+    AsyncAttrs, 
+    AsyncEngine,
+    AsyncSession,
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
-from app.config import get_db_url
+from app.config import get_db_url, settings
 
 
 DATABASE_URL = get_db_url()
 
-engine = create_async_engine(DATABASE_URL)
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that also counts how long checkouts wait for a connection
+    and how often the pool has to overflow or times out
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflow_events = 0
+        self.timeouts = 0
+
+
+    def _do_get(self):
+        started = time.perf_counter()
+        overflow = self._overflow
+
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.timeouts += 1
+            raise
+
+        waited = time.perf_counter() - started
+        self.checkouts += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+        # a connection was opened above `pool_size`
+        if self._overflow > max(overflow, 0):
+            self.overflow_events += 1
+
+        return connection
+
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'max_overflow': self._max_overflow,
+            'checkouts': self.checkouts,
+            'wait_seconds_total': round(self.wait_total, 6),
+            'wait_seconds_max': round(self.wait_max, 6),
+            'overflow_events': self.overflow_events,
+            'timeouts': self.timeouts,
+        }
+
+
+class StatementStats:
+    """
+    Counts statements executed by an engine and the time they took
+    """
+    def __init__(self):
+        self.statements = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+
+    def attach(self, engine: AsyncEngine) -> None:
+        event.listen(engine.sync_engine, 'before_cursor_execute', self._before)
+        event.listen(engine.sync_engine, 'after_cursor_execute', self._after)
+
+
+    def _before(self, connection, cursor, statement, parameters, context, executemany):
+        context._started = time.perf_counter()
+
+
+    def _after(self, connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._started
+
+        self.statements += 1
+        self.seconds_total += elapsed
+        self.seconds_max = max(self.seconds_max, elapsed)
+
+
+    def stats(self) -> dict:
+        return {
+            'statements': self.statements,
+            'seconds_total': round(self.seconds_total, 6),
+            'seconds_max': round(self.seconds_max, 6),
+        }
+
+
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedPool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args={
+        # SQLAlchemy's cache of prepared statements and the one of asyncpg itself
+        'prepared_statement_cache_size': settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+        'statement_cache_size': settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+    },
+)
+
+statement_stats = StatementStats()
+statement_stats.attach(engine)
+
+
+def database_stats() -> dict:
+    """
+    Connection pool and statement counters of this process
+    """
+    return {
+        'pool': engine.pool.stats(), # type: ignore
+        'statements': statement_stats.stats(),
+    }
+
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+
+@asynccontextmanager
+async def unit_of_work(session: AsyncSession | None = None) -> AsyncIterator[AsyncSession]:
+    """
+    Joins the transaction of `session` if it is given, 
+    otherwise opens a new session and commits it on exit
+    (rolls back if the block raises)
+    """
+    if session is not None:
+        yield session
+        return
+
+    async with async_session_maker() as session:
+        async with session.begin():
+            yield session
+
+        for callback in session.info.pop('after_commit', []):
+            await callback()
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], Awaitable]) -> None:
+    """
+    Runs `callback` once the transaction of `session` is committed,
+    e.g. cache updates, so nobody caches rows that may still be rolled back
+    """
+    session.info.setdefault('after_commit', []).append(callback)
+
+
+def has_pending_writes(session: AsyncSession | None) -> bool:
+    return session is not None and bool(session.info.get('after_commit'))
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """
+    Request-scoped unit of work, every data access call of a request 
+    shares one connection and one transaction.
+    Has to be used as `Depends(get_session, scope='function')`,
+    so the transaction is committed before the response is sent
+    """
+    async with unit_of_work() as session:
+        yield session
+
 # additional fields for every database table 
 created_at = Annotated[datetime, mapped_column(server_default=func.now())]
 updated_at = Annotated[datetime, mapped_column(server_default=func.now(), onupdate=func.now())]
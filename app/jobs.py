@@ -0,0 +1,86 @@
+import asyncio
+import time
+import uuid
+
+import redis.asyncio as redis
+from celery import Task
+from celery.result import AsyncResult
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from app.worker import celery_app
+from app.logs import logger
+from app.redis import r
+from app.config import settings
+
+
+# the longest a status request may wait for a job to finish
+MAX_WAIT = 30
+
+
+class JobSubmitted(BaseModel):
+    """
+    Response schema for submitted background jobs
+    """
+    job_id: str
+
+
+class JobPublic(BaseModel):
+    """
+    Status of a background job, `result` is set once it has succeeded
+    """
+    job_id: str
+    status: str
+    result: dict | None = None
+    error: str | None = None
+
+
+def _owner_key(job_id: str) -> str:
+    return f'job-owner:{job_id}'
+
+
+async def submit_job(task: Task, *args, owner_id: int | None = None) -> JobSubmitted:
+    """
+    Queues `task` with `args`, only the user `owner_id` can see the job
+    (anyone with its id if None, such jobs save nothing)
+    """
+    job_id = str(uuid.uuid4())
+
+    # the owner is recorded first, so the job is never seen without one
+    await r.set(_owner_key(job_id), '' if owner_id is None else owner_id, ex=settings.CELERY_RESULT_TTL)
+    await asyncio.to_thread(task.apply_async, args, task_id=job_id)
+
+    return JobSubmitted(job_id=job_id)
+
+
+async def get_job(job_id: str, user_id: int | None, wait: float = 0) -> JobPublic:
+    """
+    Returns status of a job of user `user_id`. With `wait` > 0 works as a long poll:
+    waits up to `wait` seconds for the job to finish.
+    Jobs of other users are "not found" as well as unknown ones
+    """
+    try:
+        owner = await r.get(_owner_key(job_id))
+    except redis.RedisError:
+        logger.warning('Job owners are unavailable', job_id=job_id)
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if owner is None or owner.decode() not in ('', str(user_id)):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='No job with such id was found')
+
+    job = AsyncResult(job_id, app=celery_app)
+    deadline = time.monotonic() + min(wait, MAX_WAIT)
+
+    # result backend client is synchronous, so it is called in a thread
+    while not await asyncio.to_thread(job.ready) and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+
+    state = await asyncio.to_thread(lambda: job.state)
+
+    if state == 'SUCCESS':
+        return JobPublic(job_id=job_id, status=state, result=job.result)
+
+    if state == 'FAILURE':
+        return JobPublic(job_id=job_id, status=state, error=str(job.result))
+
+    return JobPublic(job_id=job_id, status=state)
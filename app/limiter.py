@@ -0,0 +1,152 @@
+import time
+from collections import OrderedDict
+
+import redis.asyncio as redis
+from fastapi import Request, HTTPException, status
+from jose import jwt, JWTError
+
+from app.logs import logger
+from app.redis import r
+from app.config import settings, get_auth_data
+
+
+# refills the bucket by elapsed time, charges `debt` (already spent locally)
+# and then `cost` if there are enough tokens.
+# Returns {allowed, tokens left, milliseconds to wait if not allowed}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local debt = tonumber(ARGV[4])
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate) - debt
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / rate * 1000)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+
+return {allowed, tostring(tokens), retry_after}
+"""
+
+# callers whose last known buckets are kept by every limiter
+LOCAL_STATES_SIZE = 10_000
+
+
+def get_identity(request: Request) -> str:
+    """
+    Whom the bucket belongs to: id of the user with a valid token,
+    otherwise IP of the client (made up tokens must not give new buckets)
+    """
+    token = request.cookies.get('user_access_token')
+
+    if token:
+        try:
+            auth_data = get_auth_data()
+            payload = jwt.decode(token, auth_data['secret_key'], algorithms=auth_data['algorithm'])
+            return f'user:{payload["sub"]}'
+        except JWTError:
+            pass
+
+    return f'ip:{request.client.host if request.client else "unknown"}'
+
+
+class CostLimiter:
+    """
+    Token bucket rate limiter (FastAPI dependency) that charges a request by its size:
+    1 unit plus 1 per RATE_LIMIT_UNIT_BYTES of body. Routes limited with the same 
+    `route` name share buckets, sizes of buckets are configured in RATE_LIMITS 
+    as (capacity, units refilled per second), `default` for routes not listed there.
+    Buckets are shared by all workers through one atomic Redis script.
+
+    Callers that had plenty of tokens at the last check are let through
+    without Redis, spending up to RATE_LIMIT_LOCAL_SHARE of capacity
+    that is charged to Redis with their next checked request
+    """
+    # last known buckets of callers by route, limiters of one route share them,
+    # identity -> (tokens at last check, time of last check, spent since then)
+    _local_states: dict[str, OrderedDict[str, tuple[float, float, float]]] = {}
+
+
+    def __init__(self, route: str, redis_client: redis.Redis = r):
+        self.route = route
+        self.capacity, self.rate = (
+            settings.RATE_LIMITS.get(route) or settings.RATE_LIMITS.get('default', (1, 1))
+        )
+        self.local_budget = settings.RATE_LIMIT_LOCAL_SHARE * self.capacity
+
+        self.redis = redis_client
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+        self._local = CostLimiter._local_states.setdefault(route, OrderedDict())
+
+
+    async def get_cost(self, request: Request) -> float:
+        # body is cached by the request, so the endpoint does not read it again
+        body = await request.body()
+        cost = 1 + len(body) // settings.RATE_LIMIT_UNIT_BYTES
+
+        # a request bigger than the bucket is let through only with a full bucket
+        return min(cost, self.capacity)
+
+
+    def _check_locally(self, identity: str, cost: float) -> bool:
+        state = self._local.get(identity)
+        if state is None or not self.local_budget:
+            return False
+
+        tokens, checked_at, spent = state
+        tokens = min(self.capacity, tokens + (time.monotonic() - checked_at) * self.rate)
+
+        # other workers may spend up to the same budget meanwhile
+        if spent + cost > self.local_budget or tokens - spent - cost < self.local_budget:
+            return False
+
+        self._local[identity] = (state[0], checked_at, spent + cost)
+        self._local.move_to_end(identity)
+        return True
+
+
+    async def __call__(self, request: Request) -> None:
+        identity = get_identity(request)
+        cost = await self.get_cost(request)
+
+        if self._check_locally(identity, cost):
+            return
+
+        _, _, spent = self._local.pop(identity, (0, 0, 0))
+
+        try:
+            allowed, tokens, retry_after = await self._script(
+                keys=[f'rate-limit:{self.route}:{identity}'],
+                args=[self.capacity, self.rate, cost, spent],
+            )
+        except redis.RedisError:
+            logger.warning('Rate limiter is unavailable', route=self.route)
+            return
+
+        self._local[identity] = (float(tokens), time.monotonic(), 0)
+        if len(self._local) > LOCAL_STATES_SIZE:
+            self._local.popitem(last=False)
+
+        if not allowed:
+            logger.debug('Rate limit exceeded', route=self.route, identity=identity, cost=cost)
+            raise HTTPException(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                detail='Too many requests',
+                headers={'Retry-After': str(-(-retry_after // 1000))},
+            )
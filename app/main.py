@@ -1,27 +1,38 @@
-from fastapi import FastAPI
+import asyncio
 
-# requests limiter
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
+from fastapi import FastAPI, HTTPException, status
 
 from contextlib import asynccontextmanager
 
 # routers
-from app.sentiments.router import router as sentiment_router
+from app.sentiments.router import router as sentiment_router, engine, pool
 from app.summaries.router import router as summaries_router
 from app.users.router import router as users_router
 from app.redis import r
 from app.logs import logger
+from app.config import settings
+from app.data_access import BaseDA
+from app.database import database_stats
+from app.cache import listen_invalidations
+from app.summaries.cache import summary_cache
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await FastAPILimiter.init(r)
     logger.info('Starting server...')
 
+    invalidations = asyncio.create_task(listen_invalidations(r))
+
+    # the model is loaded in the background, `/ready` tells when it is done
+    if settings.INFERENCE_WARMUP:
+        pool.start_warmup()
+
     yield
 
     logger.info('Shutting down server...')
+    invalidations.cancel()
+    await engine.stop()
+    pool.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -33,6 +44,37 @@ def index():
     return {'message': 'Welcome!'}
 
 
+@app.get('/ready', tags=['Home'])
+async def ready():
+    """
+    Readiness probe: responds 503 until the sentiment model is loaded.
+    Starts loading it if it is not loading yet (e.g. with INFERENCE_WARMUP off)
+    """
+    if not pool.ready:
+        pool.start_warmup()
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail='Model is loading')
+
+    return {'status': 'ready'}
+
+
+@app.get('/metrics/cache', tags=['Home'])
+def cache_metrics():
+    """
+    Hit and miss counters of row caches and of the shared summary cache
+    of this worker process
+    """
+    return BaseDA.cache_stats() | {'summary_results': summary_cache.stats()}
+
+
+@app.get('/metrics/database', tags=['Home'])
+def database_metrics():
+    """
+    Connection pool (checkouts, waits, overflows) and statement counters
+    of this worker process
+    """
+    return database_stats()
+
+
 app.include_router(sentiment_router)
 app.include_router(summaries_router)
 app.include_router(users_router)
@@ -0,0 +1,33 @@
+"""Add packed sentiments column
+
+Revision ID: 5e93a7c1d2b4
+Revises: c47d1e0b5f22
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e93a7c1d2b4'
+down_revision: Union[str, Sequence[str], None] = 'c47d1e0b5f22'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # existing rows keep their arrays, `python -m app.sentiments.repack` packs them
+    op.add_column('sentiments', sa.Column('sentiments_packed', sa.LargeBinary(), nullable=True))
+    op.alter_column('sentiments', 'sentiments', existing_type=postgresql.ARRAY(sa.Float()), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # packed rows have to be unpacked first: `python -m app.sentiments.repack --encoding array`
+    op.alter_column('sentiments', 'sentiments', existing_type=postgresql.ARRAY(sa.Float()), nullable=False)
+    op.drop_column('sentiments', 'sentiments_packed')
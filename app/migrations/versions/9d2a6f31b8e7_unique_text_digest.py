@@ -0,0 +1,45 @@
+"""Make (user_id, text_digest) unique
+
+Revision ID: 9d2a6f31b8e7
+Revises: 5e93a7c1d2b4
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d2a6f31b8e7'
+down_revision: Union[str, Sequence[str], None] = '5e93a7c1d2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ('sentiments', 'summaries')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        # the same text could be saved twice by concurrent requests,
+        # the oldest row is kept (cached copies of others expire with the row cache TTL)
+        op.execute(
+            f"DELETE FROM {table} AS newer USING {table} AS older "
+            f"WHERE newer.user_id = older.user_id "
+            f"AND newer.text_digest = older.text_digest "
+            f"AND newer.id > older.id"
+        )
+
+        op.drop_index(f'ix_{table}_user_id_text_digest', table_name=table)
+        op.create_index(
+            f'ix_{table}_user_id_text_digest', table, ['user_id', 'text_digest'], unique=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_user_id_text_digest', table_name=table)
+        op.create_index(f'ix_{table}_user_id_text_digest', table, ['user_id', 'text_digest'])
@@ -0,0 +1,43 @@
+"""Add text_digest to sentiments and summaries
+
+Revision ID: c47d1e0b5f22
+Revises: 8b1e4c2f9a10
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47d1e0b5f22'
+down_revision: Union[str, Sequence[str], None] = '8b1e4c2f9a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ('sentiments', 'summaries')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        op.add_column(table, sa.Column('text_digest', sa.String(length=64), nullable=True))
+
+        # must match app.data_access.get_text_digest
+        op.execute(
+            f"UPDATE {table} "
+            f"SET text_digest = encode(sha256(convert_to(source_text, 'UTF8')), 'hex')"
+        )
+
+        op.alter_column(table, 'text_digest', nullable=False)
+        op.create_index(f'ix_{table}_user_id_text_digest', table, ['user_id', 'text_digest'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_user_id_text_digest', table_name=table)
+        op.drop_column(table, 'text_digest')
@@ -0,0 +1,32 @@
+"""Add (user_id, id) indexes for pagination
+
+Revision ID: e6b48c0a71d3
+Revises: 9d2a6f31b8e7
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b48c0a71d3'
+down_revision: Union[str, Sequence[str], None] = '9d2a6f31b8e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ('sentiments', 'summaries')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        op.create_index(f'ix_{table}_user_id_id', table, ['user_id', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_user_id_id', table_name=table)
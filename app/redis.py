@@ -1,15 +1,12 @@
 import redis.asyncio as redis
-from safir.redis import PydanticRedisStorage
 from app.config import settings
 
 
-r = redis.Redis(port=settings.REDIS_PORT)
-
-
-def get_storage(pydantic_model, prefix = "") -> PydanticRedisStorage:
-    """
-    Provides storage for saving pydantic models into redis.
-    With prefix key in redis looks like this: prefixMyKey.
-    """
-    return PydanticRedisStorage(datatype=pydantic_model, redis=r, key_prefix=prefix)
-    
\ No newline at end of file
+r = redis.Redis(
+    connection_pool=redis.BlockingConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+    )
+)
@@ -1,10 +1,14 @@
+import io
 import re
-import torch
-import matplotlib.pyplot as plt
+from pathlib import Path
+
+import numpy as np
 
 from razdel import sentenize
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from scipy.signal import savgol_filter
+
+# torch, transformers, scipy and matplotlib are imported where they are used:
+# they take seconds and hundreds of MB to import, and most processes
+# that import this module (API workers, migrations) never run the model
 
 
 def preprocess_text(raw_text: str | bytes) -> list[str]:
@@ -15,14 +19,120 @@ def preprocess_text(raw_text: str | bytes) -> list[str]:
     return sentences
 
 
+def preprocess_text_spans(raw_text: str) -> list[tuple[int, int, str]]:
+    """
+    Same sentences as `preprocess_text` gives,
+    each with its (start, stop) position in `raw_text`
+    """
+    # index in `raw_text` of every character of the cleaned text
+    pieces, offsets = [], []
+
+    for match in re.finditer(r'\s+|\S+', raw_text):
+        if match.group().isspace():
+            pieces.append(' ')
+            offsets.append(match.start())
+        else:
+            pieces.append(match.group())
+            offsets.extend(range(match.start(), match.end()))
+
+    cleaned_text = ''.join(pieces)
+
+    spans = []
+    for sent in sentenize(cleaned_text):
+        # razdel gives one empty sentence for empty (or blank) text
+        if sent.start == sent.stop:
+            start = offsets[sent.start] if sent.start < len(offsets) else 0
+            spans.append((start, start, sent.text))
+            continue
+
+        spans.append((offsets[sent.start], offsets[sent.stop - 1] + 1, sent.text))
+
+    return spans
+
+
+MODEL_CHECKPOINT = 'cointegrated/rubert-tiny-sentiment-balanced'
+
+# file names of exported graphs inside the ONNX directory, by backend
+ONNX_FILES = {
+    'onnx': 'model.onnx',
+    'onnx-int8': 'model.int8.onnx',
+}
+
+# weights of (negative, neutral, positive) probabilities
+SENTIMENT_WEIGHTS = np.array([-1, 0, 1])
+
+
 class SentimentAnalyzer:
-    def __init__(self):
-        self.__model_checkpoint = 'cointegrated/rubert-tiny-sentiment-balanced'
+    """
+    Runs the sentiment model with one of the backends:
+    - `torch`: eager PyTorch model from the hub
+    - `onnx`: exported fp32 ONNX graph, run with ONNX Runtime on CPU
+    - `onnx-int8`: the same graph with dynamically int8-quantized weights
+
+    ONNX graphs are created by `python -m app.sentiments.export`
+    """
+    def __init__(
+        self,
+        backend: str = 'torch',
+        onnx_dir: str | Path | None = None,
+        num_threads: int | None = None,
+    ):
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self.backend = backend
+        self.__model_checkpoint = MODEL_CHECKPOINT
         self.__tokenizer = AutoTokenizer.from_pretrained(self.__model_checkpoint)
-        self.__model = AutoModelForSequenceClassification.from_pretrained(self.__model_checkpoint)
 
-        if torch.cuda.is_available():
-            self.__model.cuda()
+        if backend == 'torch':
+            import torch
+
+            self.__tensors = 'pt'
+            self.__model = AutoModelForSequenceClassification.from_pretrained(self.__model_checkpoint)
+
+            if torch.cuda.is_available():
+                self.__model.cuda()
+
+        elif backend in ONNX_FILES:
+            import onnxruntime
+
+            if onnx_dir is None:
+                raise ValueError(f'`onnx_dir` is required for {backend} backend')
+
+            options = onnxruntime.SessionOptions()
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+                options.inter_op_num_threads = 1
+
+            self.__tensors = 'np'
+            self.__session = onnxruntime.InferenceSession(
+                str(Path(onnx_dir) / ONNX_FILES[backend]),
+                sess_options=options,
+                providers=['CPUExecutionProvider'],
+            )
+            self.__input_names = {node.name for node in self.__session.get_inputs()}
+
+        else:
+            raise ValueError(f'Unknown sentiment backend: {backend}')
+
+
+    def __proba(self, inputs) -> np.ndarray:
+        """
+        Probabilities of (negative, neutral, positive) for tokenized `inputs`
+        """
+        if self.backend == 'torch':
+            import torch
+
+            with torch.no_grad():
+                inputs = inputs.to(self.__model.device)
+                return torch.sigmoid(self.__model(**inputs).logits).cpu().numpy()
+
+        feed = {
+            name: value.astype(np.int64)
+            for name, value in inputs.items() if name in self.__input_names
+        }
+        logits = self.__session.run(['logits'], feed)[0]
+
+        return 1 / (1 + np.exp(-logits))
 
 
     def estimate_sentiment(self, raw_text: str | bytes) -> list[float]:
@@ -35,13 +145,47 @@ class SentimentAnalyzer:
         sentiment_result = []
 
         for sentence in sentences:
-            with torch.no_grad():
-                inputs = self.__tokenizer(
-                    sentence, return_tensors='pt', truncation=True, padding=True
-                ).to(self.__model.device)
-                proba = torch.sigmoid(self.__model(**inputs).logits).cpu().numpy()[0]
+            inputs = self.__tokenizer(
+                sentence, return_tensors=self.__tensors, truncation=True, padding=True
+            )
+            proba = self.__proba(inputs)[0]
 
-                sentiment_result.append(proba.dot([-1, 0, 1]))
+            sentiment_result.append(proba.dot(SENTIMENT_WEIGHTS))
+
+        return sentiment_result
+
+
+    def estimate_sentiment_batched(self, raw_text: str | bytes, bucket_size: int = 32) -> list[float]:
+        """
+        Same as `estimate_sentiment`, but sentences of the document
+        are scored in length buckets instead of one by one
+        """
+        return self.score_sentences(preprocess_text(raw_text), bucket_size=bucket_size)
+
+
+    def score_sentences(self, sentences: list[str], bucket_size: int = 32) -> list[float]:
+        """
+        Scores already preprocessed sentences.
+        Sentences are sorted by token length and split into buckets of
+        `bucket_size`, so every forward pass pads only to the longest
+        sentence of its bucket. Scores are returned in the same order as `sentences`
+        """
+        if not sentences:
+            return []
+
+        encoded = self.__tokenizer(sentences, truncation=True)
+        order = sorted(range(len(sentences)), key=lambda i: len(encoded['input_ids'][i]))
+        sentiment_result = [0.0] * len(sentences)
+
+        for start in range(0, len(order), bucket_size):
+            bucket = order[start:start + bucket_size]
+            features = [{key: encoded[key][i] for key in encoded.keys()} for i in bucket]
+
+            inputs = self.__tokenizer.pad(features, return_tensors=self.__tensors)
+            proba = self.__proba(inputs)
+
+            for i, score in zip(bucket, proba.dot(SENTIMENT_WEIGHTS).tolist()):
+                sentiment_result[i] = score
 
         return sentiment_result
 
@@ -54,25 +198,77 @@ class GraphCreator:
     
 
     def ensemble_filter(self, number_of_filters: int = 100):
-        data_length = len(self.data)
+        """
+        Smooths the data with an ensemble of moving averages:
+        up to `number_of_filters` window lengths from 1/10 to 1/4 of the data length,
+        averaged over the windows actually used.
+
+        Every window sum is a difference of two values of one cumulative sum,
+        so the sum over all windows is a single correlation of that cumulative sum
+        with a sparse kernel, done with one FFT.
+        Like `savgol_filter(mode='interp')` with polyorder 0, the first and last
+        `window // 2` points of every window get the mean of the first and last `window` points
+        """
+        data = np.asarray(self.data, dtype=np.float64)
+        data_length = len(data)
 
         start = data_length // 10
         stop = data_length // 4
         step = (stop - start) // number_of_filters
         step = step if step != 0 else 1
 
-        all_filters = 0
+        windows = np.arange(max(start, 1), stop, step)
+        if windows.size == 0:
+            self.filtered_data = data.copy()
+            return type(self.filtered_data)
+
+        # window of length w around i covers [i - before, i + after]
+        before = (windows - 1) // 2
+        after = windows - 1 - before
+        pad = int(after.max())
 
-        for window_length in range(start, stop, step):
-            filtered = savgol_filter(self.data, window_length=window_length, polyorder=0)
-            all_filters += filtered
-        
-        self.filtered_data = all_filters / number_of_filters
+        # centering keeps the cumulative sum small, so FFT does not lose precision
+        mean = data.mean()
+        padded = np.pad(data - mean, pad, mode='edge')
+        cumsum = np.concatenate(([0.0], np.cumsum(padded)))
+
+        # sum of window w at i is cumsum[i + pad + after + 1] - cumsum[i + pad - before]
+        kernel = np.zeros(2 * pad + 2)
+        np.add.at(kernel, pad + after + 1, 1 / windows)
+        np.add.at(kernel, pad - before, -1 / windows)
+
+        size = len(cumsum) + len(kernel) - 1
+        fft_size = 1 << (size - 1).bit_length()
+        correlated = np.fft.irfft(
+            np.fft.rfft(cumsum, fft_size) * np.fft.rfft(kernel[::-1], fft_size), fft_size
+        )
+        all_filters = correlated[len(kernel) - 1:len(kernel) - 1 + data_length]
+
+        # padded values only reach the edges, those are replaced window by window
+        for window, window_before, window_after in zip(windows, before, after):
+            edge = window // 2
+            if edge == 0:
+                continue
+
+            # sums of the window at the first and the last `edge` points
+            head = pad + window_after + 1
+            tail = pad + data_length - edge - window_before
+            head_sums = cumsum[head:head + edge] - cumsum[head - window:head - window + edge]
+            tail_sums = cumsum[tail + window:tail + window + edge] - cumsum[tail:tail + edge]
+
+            all_filters[:edge] += (cumsum[pad + window] - cumsum[pad] - head_sums) / window
+            all_filters[-edge:] += (
+                cumsum[pad + data_length] - cumsum[pad + data_length - window] - tail_sums
+            ) / window
+
+        self.filtered_data = all_filters / len(windows) + mean
 
         return type(self.filtered_data)
 
 
     def create_graph(self, show: bool = False, numer_of_filters = 100) -> None:
+        import matplotlib.pyplot as plt
+
         self.ensemble_filter(numer_of_filters)
 
         plt.figure(figsize=(8, 6), dpi=100)
@@ -83,3 +279,36 @@ class GraphCreator:
 
         if show:
             plt.show()
+
+
+    def render(
+        self,
+        format: str = 'png',
+        width: float = 8,
+        height: float = 6,
+        dpi: int = 100,
+        number_of_filters: int = 100,
+    ) -> bytes:
+        """
+        Same graph as `create_graph`, rendered to PNG or SVG bytes.
+        Uses its own figure and canvas instead of global pyplot state,
+        so it is safe to call from several threads at once
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.ensemble_filter(number_of_filters)
+
+        figure = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvasAgg(figure)
+
+        axes = figure.add_subplot()
+        axes.plot(self.filtered_data)
+        axes.set_xlabel('Number of sentence')
+        axes.set_ylabel('Sentiment')
+        axes.grid()
+
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format=format)
+
+        return buffer.getvalue()
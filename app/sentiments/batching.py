@@ -0,0 +1,191 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from app.sentiments.analyzer import preprocess_text
+from app.sentiments.cache import SentenceScoreCache
+from app.logs import logger
+
+
+class BatchingEngine:
+    """
+    Collects sentences from every in-flight request into one queue
+    and scores them as padded batches.
+    A batch is flushed when it reaches `max_batch_size` sentences
+    or when the oldest sentence in it has waited `max_wait` seconds.
+    Up to `max_concurrency` batches are scored at the same time.
+    At most `max_pending` sentences wait in the queue (0 means no bound),
+    callers wait for free places when it is full.
+    With `cache` given, only sentences that were not scored before reach the model
+    """
+    def __init__(
+        self,
+        score: Callable[[list[str]], Awaitable[list[float]]],
+        max_batch_size: int = 64,
+        max_wait: float = 0.01,
+        max_concurrency: int = 1,
+        max_pending: int = 0,
+        cache: SentenceScoreCache | None = None,
+    ):
+        self.score_batch = score
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.cache = cache
+
+        self._queue: asyncio.Queue[tuple[str, asyncio.Future]] | None = None
+        self._worker: asyncio.Task | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._worker = asyncio.create_task(self._run())
+
+
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+        self._worker = None
+
+        for task in self._flushes:
+            task.cancel()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+    async def score(self, sentences: list[str]) -> list[float]:
+        """
+        Puts `sentences` into the shared queue and waits for their scores.
+        Scores are returned in the same order as `sentences`
+        """
+        if not sentences:
+            return []
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in sentences]
+
+        try:
+            for sentence, future in zip(sentences, futures):
+                await self._queue.put((sentence, future)) # type: ignore
+
+            return list(await asyncio.gather(*futures))
+        finally:
+            # sentences of a cancelled caller that are still queued are skipped by `_flush`
+            for future in futures:
+                future.cancel()
+
+
+    async def score_cached(
+        self, sentences: list[str], known: dict[str, float] | None = None
+    ) -> list[float]:
+        """
+        Same as `score`, but takes scores from `known` ({sentence: score})
+        and the cache, and sends only new (or changed) sentences to the model
+        """
+        known = known or {}
+        if self.cache is None and not known:
+            return await self.score(sentences)
+
+        scores: list[float | None] = [known.get(sentence) for sentence in sentences]
+
+        unknown = [i for i, score in enumerate(scores) if score is None]
+        if self.cache is not None and unknown:
+            cached = await self.cache.get_many([sentences[i] for i in unknown])
+            for i, score in zip(unknown, cached):
+                scores[i] = score
+
+        # the same sentence may repeat in a document, it is scored once
+        missing = list(dict.fromkeys(
+            sentence for sentence, score in zip(sentences, scores) if score is None
+        ))
+
+        if missing:
+            new_scores = dict(zip(missing, await self.score(missing)))
+            if self.cache is not None:
+                await self.cache.set_many(new_scores)
+            scores = [
+                new_scores[sentence] if score is None else score
+                for sentence, score in zip(sentences, scores)
+            ]
+
+        return scores # type: ignore
+
+
+    async def estimate_sentiment(
+        self, raw_text: str | bytes, known: dict[str, float] | None = None
+    ) -> list[float]:
+        """
+        Async counterpart of `SentimentAnalyzer.estimate_sentiment`,
+        sentences found in `known` ({sentence: score}) are not scored again
+        """
+        return await self.score_cached(preprocess_text(raw_text), known)
+
+
+    async def _collect(self) -> list[tuple[str, asyncio.Future]]:
+        queue = self._queue
+        batch = [await queue.get()] # type: ignore
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not queue.empty(): # type: ignore
+                batch.append(queue.get_nowait()) # type: ignore
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout)) # type: ignore
+            except TimeoutError:
+                break
+
+        return batch
+
+
+    async def _run(self) -> None:
+        while True:
+            # sentences keep piling up in the queue while all slots are busy,
+            # so the next batch is as full as possible
+            await self._slots.acquire() # type: ignore
+            batch = await self._collect()
+
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+
+    async def _flush(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        try:
+            # callers that went away (e.g. client disconnected) are not scored
+            batch = [(sentence, future) for sentence, future in batch if not future.done()]
+            if not batch:
+                return
+
+            try:
+                scores = await self.score_batch([sentence for sentence, _ in batch])
+            except Exception as e:
+                logger.exception('Failed to score sentences batch', size=len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            for (_, future), score in zip(batch, scores):
+                if not future.done():
+                    future.set_result(score)
+        finally:
+            self._slots.release() # type: ignore
@@ -0,0 +1,95 @@
+import hashlib
+from collections import OrderedDict
+
+import redis.asyncio as redis
+
+from app.logs import logger
+
+
+def sentence_key(sentence: str) -> str:
+    """
+    Hash of the normalized sentence, used as a cache key
+    """
+    normalized = ' '.join(sentence.split())
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+
+class SentenceScoreCache:
+    """
+    Cache of sentence scores.
+    The first tier is an in-process LRU of `maxsize` entries,
+    the second (optional) tier is Redis, shared by all workers
+    """
+    def __init__(
+        self,
+        maxsize: int = 100_000,
+        redis_client: redis.Redis | None = None,
+        prefix: str = 'sentence-score:',
+        ttl: int | None = None,
+    ):
+        self.maxsize = maxsize
+        self.redis = redis_client
+        self.prefix = prefix
+        self.ttl = ttl
+
+        self._local: OrderedDict[str, float] = OrderedDict()
+
+
+    def _remember(self, key: str, score: float) -> None:
+        self._local[key] = score
+        self._local.move_to_end(key)
+
+        if len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+
+    async def get_many(self, sentences: list[str]) -> list[float | None]:
+        """
+        Returns cached scores in the order of `sentences`, None for misses
+        """
+        keys = [sentence_key(sentence) for sentence in sentences]
+        scores: list[float | None] = []
+
+        for key in keys:
+            score = self._local.get(key)
+            if score is not None:
+                self._local.move_to_end(key)
+            scores.append(score)
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if self.redis is None or not missing:
+            return scores
+
+        try:
+            values = await self.redis.mget([self.prefix + keys[i] for i in missing])
+        except redis.RedisError:
+            logger.warning('Sentence score cache is unavailable')
+            return scores
+
+        for i, value in zip(missing, values):
+            if value is not None:
+                scores[i] = float(value)
+                self._remember(keys[i], scores[i]) # type: ignore
+
+        return scores
+
+
+    async def set_many(self, scores: dict[str, float]) -> None:
+        """
+        Stores scores of sentences given as {sentence: score}
+        """
+        keyed = {sentence_key(sentence): score for sentence, score in scores.items()}
+
+        for key, score in keyed.items():
+            self._remember(key, score)
+
+        if self.redis is None or not keyed:
+            return
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, score in keyed.items():
+                    pipe.set(self.prefix + key, repr(score), ex=self.ttl)
+                await pipe.execute()
+        except redis.RedisError:
+            logger.warning('Failed to store sentence scores in cache', count=len(keyed))
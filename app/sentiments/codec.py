@@ -0,0 +1,45 @@
+"""
+Compact binary encodings of sentiment score arrays.
+
+Encoded value starts with one byte naming the encoding:
+- `f`: packed little-endian float32 values
+- `q`: float32 scale followed by int8 values, score = value * scale
+"""
+import struct
+
+import numpy as np
+
+
+ENCODINGS = {
+    'float32': b'f',
+    'int8': b'q',
+}
+
+
+def encode_scores(scores: list[float], encoding: str) -> bytes:
+    values = np.asarray(scores, dtype=np.float64)
+
+    if encoding == 'float32':
+        return ENCODINGS['float32'] + values.astype('<f4').tobytes()
+
+    if encoding == 'int8':
+        peak = float(np.abs(values).max()) if values.size else 0.0
+        scale = peak / 127 if peak else 1.0
+        quantized = np.round(values / scale).astype(np.int8)
+
+        return ENCODINGS['int8'] + struct.pack('<f', scale) + quantized.tobytes()
+
+    raise ValueError(f'Unknown scores encoding: {encoding}')
+
+
+def decode_scores(data: bytes) -> list[float]:
+    tag, payload = data[:1], data[1:]
+
+    if tag == ENCODINGS['float32']:
+        return np.frombuffer(payload, dtype='<f4').astype(np.float64).tolist()
+
+    if tag == ENCODINGS['int8']:
+        (scale,) = struct.unpack('<f', payload[:4])
+        return (np.frombuffer(payload[4:], dtype=np.int8) * np.float64(scale)).tolist()
+
+    raise ValueError(f'Unknown scores encoding tag: {tag!r}')
@@ -1,7 +1,37 @@
 from app.data_access import BaseDA
 from app.sentiments.models import Sentiment
+from app.sentiments.codec import encode_scores
+from app.config import settings
+
+
+def scores_columns(scores: list[float], encoding: str) -> dict:
+    """
+    Column values that store `scores` with the given encoding
+    """
+    if encoding == 'array':
+        return {'sentiments_array': scores, 'sentiments_packed': None}
+
+    return {'sentiments_array': None, 'sentiments_packed': encode_scores(scores, encoding)}
 
 
 class SentimentDA(BaseDA): # type: ignore
     model = Sentiment
+    conflict_columns = ('user_id', 'text_digest')
+    field_columns = {'sentiments': ('sentiments_array', 'sentiments_packed')}
+    cache_ttl = settings.CACHE_TTL_SENTIMENTS
+
+
+    @classmethod
+    def _prepare_values(cls, values: dict) -> dict:
+        """
+        Stores `sentiments` as an array or packed bytes,
+        according to SENTIMENT_SCORES_ENCODING
+        """
+        values = super()._prepare_values(values)
+        if 'sentiments' not in values:
+            return values
+
+        values = values.copy()
+        scores = values.pop('sentiments')
 
+        return values | scores_columns(scores, settings.SENTIMENT_SCORES_ENCODING)
@@ -0,0 +1,105 @@
+"""
+Exports the sentiment model to ONNX for the `onnx` and `onnx-int8` backends.
+
+    python -m app.sentiments.export [--output-dir DIR]
+
+Writes `model.onnx` (fp32) and `model.int8.onnx` (dynamically quantized)
+and checks that both stay within `PARITY_TOLERANCE` of the torch scores
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from app.config import settings
+from app.logs import logger
+from app.sentiments.analyzer import MODEL_CHECKPOINT, ONNX_FILES, SentimentAnalyzer
+
+
+# max absolute difference from torch scores (scores are in [-1, 1])
+PARITY_TOLERANCE = {
+    'onnx': 1e-4,
+    'onnx-int8': 5e-2,
+}
+
+PARITY_SENTENCES = [
+    'Какая гадость эта ваша заливная рыба!',
+    'Сегодня отличный день, всё получилось.',
+    'Поезд прибывает в 10 часов.',
+    'Я не уверен, что это хорошая идея, но попробовать стоит.',
+    'This is the best thing that has ever happened to me.',
+    'Ужасное обслуживание, больше никогда сюда не приду, даже если '
+    'это будет единственное кафе в городе.',
+]
+
+
+def export_onnx(output_dir: Path) -> None:
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_CHECKPOINT)
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_CHECKPOINT)
+    model.eval()
+
+    inputs = tokenizer(PARITY_SENTENCES[:2], return_tensors='pt', padding=True)
+    input_names = list(inputs.keys())
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+
+    torch.onnx.export(
+        model,
+        (dict(inputs),),
+        str(output_dir / ONNX_FILES['onnx']),
+        input_names=input_names,
+        output_names=['logits'],
+        dynamic_axes=dynamic_axes | {'logits': {0: 'batch'}},
+        opset_version=17,
+    )
+    logger.info('Exported ONNX graph', path=str(output_dir / ONNX_FILES['onnx']))
+
+
+def quantize_onnx(output_dir: Path) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(
+        str(output_dir / ONNX_FILES['onnx']),
+        str(output_dir / ONNX_FILES['onnx-int8']),
+        weight_type=QuantType.QInt8,
+    )
+    logger.info('Quantized ONNX graph', path=str(output_dir / ONNX_FILES['onnx-int8']))
+
+
+def check_parity(output_dir: Path) -> bool:
+    """
+    Compares scores of every ONNX backend with the torch ones
+    """
+    expected = SentimentAnalyzer('torch').score_sentences(PARITY_SENTENCES)
+    passed = True
+
+    for backend, tolerance in PARITY_TOLERANCE.items():
+        scores = SentimentAnalyzer(backend, onnx_dir=output_dir).score_sentences(PARITY_SENTENCES)
+        max_error = max(abs(a - b) for a, b in zip(expected, scores))
+
+        if max_error > tolerance:
+            logger.error('Parity check failed', backend=backend, max_error=max_error, tolerance=tolerance)
+            passed = False
+        else:
+            logger.info('Parity check passed', backend=backend, max_error=max_error, tolerance=tolerance)
+
+    return passed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Export the sentiment model to ONNX')
+    parser.add_argument('--output-dir', type=Path, default=settings.SENTIMENT_ONNX_DIR)
+    args = parser.parse_args()
+
+    export_onnx(args.output_dir)
+    quantize_onnx(args.output_dir)
+
+    if not check_parity(args.output_dir):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
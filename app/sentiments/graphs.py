@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+
+import numpy as np
+import redis.asyncio as redis
+
+from app.sentiments.analyzer import GraphCreator
+from app.logs import logger
+from app.redis import r
+from app.config import settings
+
+
+MEDIA_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def _keys_of(sentiment_id: int) -> str:
+    # set of all cached graph keys of one sentiment, used to clean them up
+    return f'sentiment-graph-keys:{sentiment_id}'
+
+
+def _version_of(sentiments: list[float]) -> str:
+    # graphs are keyed by the scores they are drawn from, so a render
+    # of scores that have changed meanwhile is never served
+    return hashlib.blake2b(np.asarray(sentiments, dtype=np.float64).tobytes(), digest_size=8).hexdigest()
+
+
+async def get_graph(
+    sentiment_id: int,
+    sentiments: list[float],
+    format: str,
+    width: float,
+    height: float,
+    dpi: int,
+    number_of_filters: int,
+) -> bytes:
+    """
+    Returns rendered graph of sentiment analysis from cache,
+    renders it in a thread (and caches) if there is none
+    """
+    key = (
+        f'sentiment-graph:{sentiment_id}:{_version_of(sentiments)}:'
+        f'{format}:{width}x{height}:{dpi}:{number_of_filters}'
+    )
+
+    try:
+        image = await r.get(key)
+    except redis.RedisError:
+        logger.warning('Graph cache is unavailable', sentiment_id=sentiment_id)
+        image = None
+
+    if image is not None:
+        return image
+
+    image = await asyncio.to_thread(
+        GraphCreator(sentiments).render, format, width, height, dpi, number_of_filters
+    )
+
+    try:
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.set(key, image, ex=settings.SENTIMENT_GRAPH_TTL)
+            pipe.sadd(_keys_of(sentiment_id), key)
+            pipe.expire(_keys_of(sentiment_id), settings.SENTIMENT_GRAPH_TTL)
+            await pipe.execute()
+    except redis.RedisError:
+        logger.warning('Failed to cache graph', sentiment_id=sentiment_id)
+
+    return image
+
+
+async def invalidate_graphs(sentiment_id: int) -> None:
+    """
+    Drops every cached graph of a sentiment, called when it changes.
+    Graphs of old scores are never served anyway, this only frees memory
+    """
+    try:
+        keys = await r.smembers(_keys_of(sentiment_id))
+        await r.delete(_keys_of(sentiment_id), *keys)
+    except redis.RedisError:
+        logger.warning('Failed to invalidate graph cache', sentiment_id=sentiment_id)
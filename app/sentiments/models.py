@@ -1,11 +1,13 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey, Float
+from sqlalchemy import ForeignKey, Float, String, Index, LargeBinary
 from sqlalchemy.dialects.postgresql import ARRAY
 
 from pydantic import ConfigDict
+from typing import Optional
 
 from app.database import Base
 from app.users.models import User
+from app.sentiments.codec import decode_scores
 
 
 class Sentiment(Base):
@@ -13,6 +15,11 @@ class Sentiment(Base):
     Database model for results of sentiment analysis
     """
     __tablename__ = 'sentiments'
+    __table_args__ = (
+        Index('ix_sentiments_user_id_text_digest', 'user_id', 'text_digest', unique=True),
+        # keyset pagination of user's rows
+        Index('ix_sentiments_user_id_id', 'user_id', 'id'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     
@@ -20,14 +27,28 @@ class Sentiment(Base):
     
     # TEXT field to store files contents, parsed html, plain text 
     source_text: Mapped[str]
+
+    # sha256 of `source_text`, maintained by BaseDA, used to find the same text
+    text_digest: Mapped[str] = mapped_column(String(64))
     
-    sentiments: Mapped[list[float]] = mapped_column(ARRAY(Float))
+    # scores are kept either as float8[] or packed by `app.sentiments.codec`,
+    # depending on SENTIMENT_SCORES_ENCODING at the time the row was written
+    sentiments_array: Mapped[Optional[list[float]]] = mapped_column('sentiments', ARRAY(Float))
+    sentiments_packed: Mapped[Optional[bytes]] = mapped_column(LargeBinary)
 
     user: Mapped[User] = relationship('User')
 
     model_config = ConfigDict(from_attributes=True)
 
 
+    @property
+    def sentiments(self) -> list[float]:
+        if self.sentiments_packed is not None:
+            return decode_scores(self.sentiments_packed)
+
+        return self.sentiments_array # type: ignore
+
+
     def to_dict(self) -> dict:
         return {
             'id': self.id, 
@@ -0,0 +1,74 @@
+"""
+Rewrites stored sentiment scores with another encoding.
+
+    python -m app.sentiments.repack [--encoding int8] [--batch-size 500]
+
+Run it after changing SENTIMENT_SCORES_ENCODING to convert existing rows,
+or with `--encoding array` before downgrading the packed column migration
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+
+from app.config import settings
+from app.database import async_session_maker
+from app.logs import logger
+from app.sentiments.codec import ENCODINGS
+from app.sentiments.data_access import scores_columns
+from app.sentiments.models import Sentiment
+
+
+def is_encoded_with(instance: Sentiment, encoding: str) -> bool:
+    if encoding == 'array':
+        return instance.sentiments_packed is None
+
+    packed = instance.sentiments_packed
+    return packed is not None and packed[:1] == ENCODINGS[encoding]
+
+
+async def repack(encoding: str, batch_size: int) -> int:
+    last_id = 0
+    repacked = 0
+
+    while True:
+        async with async_session_maker() as session:
+            async with session.begin():
+                query = (
+                    select(Sentiment)
+                    .options(load_only(Sentiment.id, Sentiment.sentiments_array, Sentiment.sentiments_packed))
+                    .where(Sentiment.id > last_id)
+                    .order_by(Sentiment.id)
+                    .limit(batch_size)
+                )
+                instances = (await session.scalars(query)).all()
+                if not instances:
+                    break
+
+                for instance in instances:
+                    if is_encoded_with(instance, encoding):
+                        continue
+
+                    for column, value in scores_columns(instance.sentiments, encoding).items():
+                        setattr(instance, column, value)
+                    repacked += 1
+
+                last_id = instances[-1].id
+
+        logger.info('Repacked sentiments', last_id=last_id, repacked=repacked)
+
+    return repacked
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Rewrite stored sentiment scores with another encoding')
+    parser.add_argument('--encoding', choices=['array', *ENCODINGS], default=settings.SENTIMENT_SCORES_ENCODING)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    asyncio.run(repack(args.encoding, args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
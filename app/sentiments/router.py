@@ -1,25 +1,65 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import json
+from functools import partial
+from typing import Literal
 
-from fastapi_limiter.depends import RateLimiter
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.limiter import CostLimiter
 
 from app.sentiments.schemas import (
     SentimentPublic, 
     SentimentPost, 
     SentimentUpdate, 
-    SentimentDelete
+    SentimentDelete,
+    SentimentSentence,
+    SentimentBatchPost,
+    SentimentBatchItem,
+    SentimentListItem,
+    SentimentPage,
 )
-from app.sentiments.analyzer import SentimentAnalyzer
+from app.sentiments.analyzer import MODEL_CHECKPOINT, preprocess_text, preprocess_text_spans
+from app.sentiments.batching import BatchingEngine
+from app.sentiments.workers import InferencePool
+from app.sentiments.cache import SentenceScoreCache
+from app.sentiments.graphs import MEDIA_TYPES, get_graph, invalidate_graphs
 from app.sentiments.data_access import SentimentDA
+from app.sentiments import tasks
 
 from app.users.dependencies import get_current_user
+from app.data_access import get_text_digest
+from app.database import get_session, after_commit
+from app.jobs import JobSubmitted, JobPublic, submit_job, get_job
 
-from app.redis import get_storage
+from app.redis import r
+from app.config import settings
 
 
 router = APIRouter(prefix='/sentiment', tags=['Sentiments'])
 
-analyzer = SentimentAnalyzer()
-storage = get_storage(SentimentPublic, prefix='sentiment')
+pool = InferencePool(
+    workers=settings.INFERENCE_WORKERS,
+    threads_per_worker=settings.INFERENCE_THREADS_PER_WORKER,
+    backend=settings.SENTIMENT_BACKEND,
+    onnx_dir=str(settings.SENTIMENT_ONNX_DIR),
+)
+engine = BatchingEngine(
+    pool.score,
+    max_batch_size=settings.SENTIMENT_BATCH_SIZE,
+    max_wait=settings.SENTIMENT_BATCH_WAIT_MS / 1000,
+    max_concurrency=pool.workers,
+    max_pending=settings.INFERENCE_MAX_PENDING or settings.SENTIMENT_BATCH_SIZE * pool.workers * 4,
+    cache=SentenceScoreCache(
+        maxsize=settings.SENTENCE_CACHE_SIZE,
+        redis_client=r if settings.SENTENCE_CACHE_REDIS else None,
+        # scores of other models or backends differ, they must not be served
+        prefix=f'sentence-score:{MODEL_CHECKPOINT}:{settings.SENTIMENT_BACKEND}:',
+        ttl=settings.SENTENCE_CACHE_TTL,
+    ),
+)
 
 
 @router.get('/text/{id}')
@@ -31,19 +71,68 @@ async def get_sentiment(
     A function for getting sentiment analyzed text 
     from database by it's id
     """
-    instance = await storage.get(str(id))
-    if instance and instance.user_id == user.id:
-        return instance
-    
+    # read through the row cache of SentimentDA
     instance = await SentimentDA.get(id=id)
     if instance and instance.user_id == user.id:
-        _ = await storage.store(str(id), SentimentPublic.model_validate(instance.to_dict()))
         return instance
     
     raise HTTPException(status.HTTP_404_NOT_FOUND)
 
 
-@router.post('/text', dependencies=[Depends(RateLimiter(times=1, seconds=1))])
+@router.get('/texts', response_model_exclude_none=True)
+async def list_sentiments(
+    after: int | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    fields: list[Literal['user_id', 'source_text', 'sentiments']] | None = Query(None),
+    user = Depends(get_current_user),
+) -> SentimentPage:
+    """
+    User's analyses ordered by id, page by page. 
+    `fields` picks what to return besides id (everything by default),
+    e.g. `?fields=user_id` leaves out texts and scores
+    """
+    if not user:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='You are not authorized')
+
+    fields = fields or list(SentimentListItem.model_fields.keys() - {'id'})
+
+    # one extra row tells whether there is a next page
+    instances = await SentimentDA.filter_page(after, limit + 1, fields, user_id=user.id)
+    items = [
+        SentimentListItem(id=instance.id, **{field: getattr(instance, field) for field in fields})
+        for instance in instances[:limit]
+    ]
+    next_after = items[-1].id if len(instances) > limit else None
+
+    return SentimentPage(items=items, next_after=next_after)
+
+
+@router.get('/text/{id}/graph')
+async def get_sentiment_graph(
+    id: int,
+    format: Literal['png', 'svg'] = 'png',
+    width: float = Query(8, gt=0, le=40),
+    height: float = Query(6, gt=0, le=40),
+    dpi: int = Query(100, gt=0, le=300),
+    filters: int = Query(100, ge=1, le=1000),
+    user = Depends(get_current_user),
+) -> Response:
+    """
+    Smoothed graph of sentiment analysis as PNG or SVG image
+    """
+    if not user:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='You are not authorized')
+
+    instance = await SentimentDA.get(id=id)
+    if not instance or instance.user_id != user.id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
+
+    image = await get_graph(id, instance.sentiments, format, width, height, dpi, filters)
+
+    return Response(content=image, media_type=MEDIA_TYPES[format])
+
+
+@router.post('/text', dependencies=[Depends(CostLimiter('sentiment'))])
 async def analyze_sentiment(
     request_body: SentimentPost,
     user = Depends(get_current_user),
@@ -56,29 +145,183 @@ async def analyze_sentiment(
     # if user is None present, then we assume they are not planning 
     # to save result to the db, hence we definetely analyze
     if user is None:
-        sentiments = analyzer.estimate_sentiment(request_body.source_text)
+        sentiments = await engine.estimate_sentiment(request_body.source_text)
         return { # type: ignore
             'source_text': request_body.source_text, 
             'sentiments': sentiments
         }
     
     # might be the same text user have analyzed before
-    instance = await SentimentDA.get(**request_body.model_dump())
+    instance = await SentimentDA.get(user_id=user.id, **request_body.model_dump())
     
     # processing text if it has not been analyzed before
     if not instance:
-        sentiments = analyzer.estimate_sentiment(request_body.source_text)
+        sentiments = await engine.estimate_sentiment(request_body.source_text)
         
         # joining results and `user_id` to match the model
         values = request_body.model_dump() | {'sentiments': sentiments}
         values = values | {'user_id': user.id}
 
-        instance = await SentimentDA.create(**values)
+        # the same text may have been saved by a concurrent request meanwhile
+        instance = await SentimentDA.get_or_create(**values)
     
     return instance
 
 
-@router.put('/text', dependencies=[Depends(RateLimiter(times=1, seconds=1))])
+@router.post('/text/stream', dependencies=[Depends(CostLimiter('sentiment'))])
+async def stream_sentiment(
+    request_body: SentimentPost,
+    format: Literal['ndjson', 'sse'] = 'ndjson',
+    user = Depends(get_current_user),
+) -> StreamingResponse:
+    """
+    Streaming variant of `POST /sentiment/text`.
+    Every sentence is sent as soon as it is scored (NDJSON lines or 
+    server-sent events), the last message carries id of the saved analysis
+    """
+    source_text = request_body.source_text
+    spans = preprocess_text_spans(source_text)
+
+    instance = None
+    if user is not None:
+        instance = await SentimentDA.get(user_id=user.id, source_text=source_text)
+
+    def encode(data: str, event: str | None = None) -> str:
+        if format == 'ndjson':
+            return data + '\n'
+
+        return (f'event: {event}\n' if event else '') + f'data: {data}\n\n'
+
+    async def score_chunks():
+        """
+        Yields scores chunk by chunk, every chunk is already queued
+        for inference, so the model is never idle between chunks
+        """
+        if instance is not None:
+            yield instance.sentiments
+            return
+
+        size = settings.SENTIMENT_STREAM_CHUNK
+        sentences = [sentence for _, _, sentence in spans]
+        chunks = [
+            asyncio.ensure_future(engine.score_cached(sentences[i:i + size]))
+            for i in range(0, len(sentences), size)
+        ]
+
+        try:
+            for chunk in chunks:
+                yield await chunk
+        finally:
+            for chunk in chunks:
+                chunk.cancel()
+
+    async def generate():
+        sentiments = []
+
+        async for scores in score_chunks():
+            for score in scores:
+                start, stop, _ = spans[len(sentiments)]
+                sentence = SentimentSentence(
+                    index=len(sentiments), start=start, stop=stop, sentiment=score
+                )
+                sentiments.append(score)
+
+                yield encode(sentence.model_dump_json())
+
+        # the whole array is saved only when every sentence was scored
+        saved = instance
+        if saved is None and user is not None:
+            saved = await SentimentDA.get_or_create(
+                user_id=user.id, source_text=source_text, sentiments=sentiments
+            )
+
+        result = {'id': saved.id if saved else None, 'sentences': len(sentiments)}
+        yield encode(json.dumps(result), event='done')
+
+    media_type = 'application/x-ndjson' if format == 'ndjson' else 'text/event-stream'
+    return StreamingResponse(generate(), media_type=media_type)
+
+
+@router.post('/batch', dependencies=[Depends(CostLimiter('sentiment-batch'))])
+async def analyze_sentiment_batch(
+    request_body: SentimentBatchPost,
+    user = Depends(get_current_user),
+) -> list[SentimentBatchItem]:
+    """
+    Analyzes many texts at once. Texts analyzed before are found with one query,
+    sentences of all new texts are scored together
+    and results are saved with one multi-row upsert
+    """
+    if not user:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='You are not authorized')
+
+    documents = request_body.documents
+    digests = list({get_text_digest(document) for document in documents})
+
+    existing = await SentimentDA.filter_in('text_digest', digests, user_id=user.id)
+    ids = {instance.source_text: instance.id for instance in existing}
+
+    # a text repeated in the batch is analyzed and saved once
+    new_documents = [document for document in dict.fromkeys(documents) if document not in ids]
+    sentences = [preprocess_text(document) for document in new_documents]
+    scores = await engine.score_cached([sentence for doc in sentences for sentence in doc])
+
+    values = []
+    position = 0
+    for document, doc_sentences in zip(new_documents, sentences):
+        values.append({
+            'user_id': user.id,
+            'source_text': document,
+            'sentiments': scores[position:position + len(doc_sentences)],
+        })
+        position += len(doc_sentences)
+
+    new_ids = await SentimentDA.bulk_upsert(values)
+    ids |= dict(zip(new_documents, new_ids))
+
+    result = []
+    created = set(new_documents)
+    for index, document in enumerate(documents):
+        result.append(SentimentBatchItem(index=index, id=ids[document], created=document in created))
+        created.discard(document)
+
+    return result
+
+
+@router.post(
+    '/jobs',
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(CostLimiter('sentiment'))],
+)
+async def submit_sentiment_job(
+    request_body: SentimentPost,
+    user = Depends(get_current_user),
+) -> JobSubmitted:
+    """
+    Queues analysis of a text for Celery workers and returns at once,
+    result is fetched with `GET /sentiment/jobs/{job_id}`
+    """
+    user_id = user.id if user else None
+
+    return await submit_job(
+        tasks.analyze_sentiment, request_body.source_text, user_id, owner_id=user_id
+    )
+
+
+@router.get('/jobs/{job_id}')
+async def get_sentiment_job(
+    job_id: str, 
+    wait: float = 0,
+    user = Depends(get_current_user),
+) -> JobPublic:
+    """
+    Status of a background analysis, waits up to `wait` seconds
+    for it to finish (long poll)
+    """
+    return await get_job(job_id, user.id if user else None, wait)
+
+
+@router.put('/text', dependencies=[Depends(CostLimiter('sentiment'))])
 async def update_sentiment(
     request_body: SentimentUpdate,
     user= Depends(get_current_user),
@@ -97,39 +340,51 @@ async def update_sentiment(
     if not existing_instance or existing_instance.user_id != user.id:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail='No sentiment with such id was found')
     
-    filter_by = {'id': request_body.id}
-    updated_sentiments = analyzer.estimate_sentiment(request_body.updated_text)
+    # sentences that were not changed keep their scores, only the rest reach the model
+    known = dict(zip(preprocess_text(existing_instance.source_text), existing_instance.sentiments))
+    updated_sentiments = await engine.estimate_sentiment(request_body.updated_text, known)
 
     values = {
         'source_text': request_body.updated_text,
         'sentiments': updated_sentiments
     }
-    is_updated = await SentimentDA.update(filter_by, **values)
-    
-    if is_updated:
-        instance = await SentimentDA.get(**filter_by) 
 
-        return instance # type: ignore
+    # one UPDATE ... RETURNING, ownership is checked again in case the row has changed
+    try:
+        updated = await SentimentDA.update(
+            {'id': request_body.id, 'user_id': user.id}, **values
+        )
+    except IntegrityError:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail='This text was already analyzed')
+    
+    if updated:
+        await invalidate_graphs(request_body.id)
+        return updated[0]
 
     raise HTTPException(status.HTTP_304_NOT_MODIFIED)
 
 
-@router.delete('/text', dependencies=[Depends(RateLimiter(times=1, seconds=1))])
+@router.delete('/text', dependencies=[Depends(CostLimiter('sentiment-delete'))])
 async def delete_sentiment(
     request_body: SentimentDelete,
     user = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session, scope='function'),
 ) -> dict:
     """
     Deletes sentiment analysis by a given id or a source_text
     """ 
-    existing_instance = await SentimentDA.get(id=request_body.id)
-    if not existing_instance or existing_instance.user_id != user.id:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, detail='No sentiment with such id was found')
-    
-    is_deleted = await SentimentDA.delete(**request_body.model_dump())
+    if not user:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='You are not authorized')
+
+    # someone else's sentiment is not matched, so it is "not found" as well
+    deleted_ids = await SentimentDA.delete(
+        session=session, user_id=user.id, **request_body.model_dump()
+    )
+
+    if deleted_ids:
+        for id in deleted_ids:
+            after_commit(session, partial(invalidate_graphs, id))
 
-    if is_deleted:
         return {'status': 'ok'}
 
-    raise HTTPException(status.HTTP_404_NOT_FOUND)
-    
\ No newline at end of file
+    raise HTTPException(status.HTTP_404_NOT_FOUND, detail='No sentiment with such id was found')
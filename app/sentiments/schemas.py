@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class SentimentPublic(BaseModel):
@@ -11,6 +11,25 @@ class SentimentPublic(BaseModel):
     sentiments: list[float]
 
 
+class SentimentListItem(BaseModel):
+    """
+    Sentiment analysis in a list, fields that were not requested are left out
+    """
+    id: int
+    user_id: int | None = None
+    source_text: str | None = None
+    sentiments: list[float] | None = None
+
+
+class SentimentPage(BaseModel):
+    """
+    One page of user's analyses, the next one is requested 
+    with `after=next_after` (None when this page is the last)
+    """
+    items: list[SentimentListItem]
+    next_after: int | None = None
+
+
 class SentimentPost(BaseModel):
     """
     Defines POST request schema
@@ -18,6 +37,34 @@ class SentimentPost(BaseModel):
     source_text: str
 
 
+class SentimentBatchPost(BaseModel):
+    """
+    Defines POST request schema for analyzing many texts at once
+    """
+    documents: list[str] = Field(..., min_length=1, max_length=1000)
+
+
+class SentimentBatchItem(BaseModel):
+    """
+    Row id of one document of a batch, in the order of `documents`.
+    `created` is False when the text had been analyzed before
+    """
+    index: int
+    id: int
+    created: bool
+
+
+class SentimentSentence(BaseModel):
+    """
+    One scored sentence of a streamed analysis,
+    `start` and `stop` are positions of the sentence in the source text
+    """
+    index: int
+    start: int
+    stop: int
+    sentiment: float
+
+
 class SentimentUpdate(BaseModel):
     """
     Schema for updating existing analysis
@@ -0,0 +1,42 @@
+from app.worker import celery_app, run_async
+from app.config import settings
+from app.sentiments.data_access import SentimentDA
+
+
+# created on the first task, so that only worker processes load the model
+_analyzer = None
+
+
+def get_analyzer():
+    global _analyzer
+
+    if _analyzer is None:
+        from app.sentiments.analyzer import SentimentAnalyzer
+
+        _analyzer = SentimentAnalyzer(
+            settings.SENTIMENT_BACKEND, onnx_dir=settings.SENTIMENT_ONNX_DIR
+        )
+
+    return _analyzer
+
+
+@celery_app.task(name='sentiments.analyze')
+def analyze_sentiment(source_text: str, user_id: int | None = None) -> dict:
+    """
+    Background version of `POST /sentiment/text`
+    """
+    if user_id is not None:
+        instance = run_async(SentimentDA.get(user_id=user_id, source_text=source_text))
+        if instance:
+            return {'id': instance.id, 'user_id': user_id, 'sentiments': instance.sentiments}
+
+    sentiments = get_analyzer().estimate_sentiment_batched(source_text)
+
+    if user_id is None:
+        return {'id': None, 'user_id': None, 'sentiments': sentiments}
+
+    instance = run_async(SentimentDA.get_or_create(
+        user_id=user_id, source_text=source_text, sentiments=sentiments
+    ))
+
+    return {'id': instance.id, 'user_id': user_id, 'sentiments': sentiments}
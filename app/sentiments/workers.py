@@ -0,0 +1,157 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.logs import logger
+
+
+# analyzer of the current worker process, created once by `_init_worker`
+_analyzer = None
+
+
+def _init_worker(num_threads: int, backend: str, onnx_dir: str) -> None:
+    global _analyzer
+
+    from app.sentiments.analyzer import SentimentAnalyzer
+
+    # every process gets its own share of cores instead of all of them,
+    # ONNX Runtime gets it through session options
+    if backend == 'torch':
+        import torch
+
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(1)
+
+    _analyzer = SentimentAnalyzer(backend, onnx_dir=onnx_dir, num_threads=num_threads)
+
+
+def _score_sentences(sentences: list[str]) -> list[float]:
+    return _analyzer.score_sentences(sentences) # type: ignore
+
+
+def _warmup(delay: float) -> int:
+    # holding the process for a moment makes the executor
+    # hand the other warm-up calls to the other processes
+    time.sleep(delay)
+    _score_sentences(['Прогрев модели.'])
+
+    return os.getpid()
+
+
+class InferencePool:
+    """
+    Pool of processes that run the sentiment model.
+    Each process loads the model once and scores batches of sentences,
+    so inference never blocks the event loop of the API worker
+    """
+    def __init__(
+        self,
+        workers: int = 0,
+        threads_per_worker: int = 0,
+        backend: str = 'torch',
+        onnx_dir: str | None = None,
+    ):
+        cpu_count = os.cpu_count() or 1
+
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+
+        self.workers = workers or cpu_count
+        self.threads_per_worker = threads_per_worker or max(1, cpu_count // self.workers)
+
+        self._executor: ProcessPoolExecutor | None = None
+        self._warmup: asyncio.Task | None = None
+
+        # True once every process has loaded the model
+        self.ready = False
+
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            # torch does not survive fork after its thread pools were started
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, self.backend, self.onnx_dir),
+        )
+
+        logger.info(
+            'Inference pool started',
+            backend=self.backend,
+            workers=self.workers,
+            threads_per_worker=self.threads_per_worker,
+        )
+
+
+    def shutdown(self) -> None:
+        if self._executor is None:
+            return
+
+        if self._warmup is not None:
+            self._warmup.cancel()
+            self._warmup = None
+
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        self.ready = False
+
+
+    async def warmup(self) -> None:
+        """
+        Starts every worker process and makes it load the model
+        and run one forward pass, so first requests do not pay for that
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+
+        started = time.perf_counter()
+        pids = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, _warmup, 0.5)
+            for _ in range(self.workers)
+        ])
+        self.ready = True
+
+        logger.info(
+            'Inference pool is warmed up',
+            processes=len(set(pids)),
+            seconds=round(time.perf_counter() - started, 2),
+        )
+
+
+    def start_warmup(self) -> None:
+        """
+        Runs `warmup` in the background unless the pool is ready
+        or is warming up already (a failed warm-up is started again)
+        """
+        if self.ready or (self._warmup is not None and not self._warmup.done()):
+            return
+
+        self._warmup = asyncio.create_task(self.warmup())
+        self._warmup.add_done_callback(self._log_warmup_failure)
+
+
+    @staticmethod
+    def _log_warmup_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Inference pool warm-up failed', exc_info=task.exception())
+
+
+    async def score(self, sentences: list[str]) -> list[float]:
+        """
+        Scores already preprocessed sentences in one of the worker processes
+        """
+        if not sentences:
+            return []
+
+        self.start()
+        loop = asyncio.get_running_loop()
+
+        scores = await loop.run_in_executor(self._executor, _score_sentences, sentences)
+
+        self.ready = True
+        return scores
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import redis.asyncio as redis
+
+from app.summaries.summarize import SUMMARIZERS, PROMPT_VERSION
+from app.data_access import get_text_digest
+from app.logs import logger
+from app.redis import r
+from app.config import settings
+
+
+# stores a summary, indexes its key by time of writing and drops
+# expired and the oldest keys above the size bound, all at once
+STORE_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3] - ARGV[2])
+
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess > 0 then
+    local oldest = redis.call('ZPOPMIN', KEYS[2], excess)
+    for i = 1, #oldest, 2 do
+        redis.call('DEL', oldest[i])
+    end
+end
+"""
+
+
+class SummaryCache:
+    """
+    Summaries shared by all users and workers, kept in Redis
+    for `ttl` seconds and at most `max_entries` of them (the oldest are dropped).
+    Key is made of the model, prompt version and digest of the text,
+    so changing any of them never returns stale summaries.
+    Only summaries of the LLM are kept
+    """
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        ttl: int,
+        max_entries: int,
+        prefix: str = 'summary:',
+    ):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.index = prefix + 'index'
+
+        self.hits = 0
+        self.misses = 0
+
+        self._store = redis_client.register_script(STORE_SCRIPT)
+
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+    def key(self, text: str) -> str:
+        return f'{self.prefix}{settings.OLLAMA_MODEL}:{PROMPT_VERSION}:{get_text_digest(text)}'
+
+
+    async def get(self, text: str) -> str | None:
+        try:
+            summary = await self.redis.get(self.key(text))
+        except redis.RedisError:
+            logger.warning('Summary cache is unavailable')
+            summary = None
+
+        if summary is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return summary.decode()
+
+
+    async def set(self, text: str, summary: str) -> None:
+        try:
+            await self._store(
+                keys=[self.key(text), self.index],
+                args=[summary, self.ttl, time.time(), self.max_entries],
+            )
+        except redis.RedisError:
+            logger.warning('Failed to store summary in cache')
+
+
+summary_cache = SummaryCache(
+    r, ttl=settings.SUMMARY_CACHE_TTL, max_entries=settings.SUMMARY_CACHE_MAX_ENTRIES
+)
+
+# generations in progress by cache key, so concurrent requests
+# for the same text in this process wait for one generation
+_pending: dict[str, asyncio.Task] = {}
+
+
+async def summarize_cached(text: str, mode: str = 'llm') -> str:
+    """
+    `summarize` that first looks for the summary of the same text in the shared cache
+    (if summaries of `mode` are cached at all)
+    """
+    summarizer = SUMMARIZERS[mode]
+    if not summarizer.cacheable:
+        return await summarizer.summarize(text)
+
+    summary = await summary_cache.get(text)
+    if summary is not None:
+        return summary
+
+    key = summary_cache.key(text)
+    if key not in _pending:
+        async def generate() -> str:
+            try:
+                summary = await summarizer.summarize(text)
+                await summary_cache.set(text, summary)
+                return summary
+            finally:
+                del _pending[key]
+
+        _pending[key] = asyncio.create_task(generate())
+
+    # shielded, so one cancelled request does not cancel the others
+    return await asyncio.shield(_pending[key])
@@ -1,6 +1,9 @@
 from app.data_access import BaseDA
 from app.summaries.models import Summary
+from app.config import settings
 
 
 class SummaryDA(BaseDA): # type: ignore
     model = Summary
+    conflict_columns = ('user_id', 'text_digest')
+    cache_ttl = settings.CACHE_TTL_SUMMARIES
@@ -0,0 +1,101 @@
+"""
+Extractive summaries: the most central sentences of a text, in their original order.
+Runs on CPU in milliseconds, no model is needed
+"""
+import re
+
+import numpy as np
+
+from app.sentiments.analyzer import preprocess_text
+
+
+WORD = re.compile(r'\w+')
+
+# TextRank builds a sentences x sentences similarity matrix,
+# longer texts are scored by similarity to their centroid instead
+TEXTRANK_MAX_SENTENCES = 1000
+
+DAMPING = 0.85
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-6
+
+
+def sentence_vectors(sentences: list[str]):
+    """
+    TF-IDF vectors of sentences (sparse, rows have unit length)
+    """
+    from scipy.sparse import csr_matrix
+
+    vocabulary: dict[str, int] = {}
+    rows, columns = [], []
+
+    for row, sentence in enumerate(sentences):
+        for word in WORD.findall(sentence.lower()):
+            rows.append(row)
+            columns.append(vocabulary.setdefault(word, len(vocabulary)))
+
+    counts = csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+        shape=(len(sentences), len(vocabulary)),
+    )
+    counts.sum_duplicates()
+
+    # every (sentence, word) pair is stored once, so this is document frequency
+    document_frequency = np.bincount(counts.indices, minlength=len(vocabulary))
+    idf = np.log((1 + len(sentences)) / (1 + document_frequency)) + 1
+
+    vectors = csr_matrix(counts.multiply(idf.astype(np.float32)))
+    norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+
+    return csr_matrix(vectors.multiply(1 / norms[:, None]))
+
+
+def textrank_scores(vectors) -> np.ndarray:
+    """
+    PageRank over the graph of cosine similarities between sentences
+    """
+    similarity = (vectors @ vectors.T).toarray()
+    np.fill_diagonal(similarity, 0)
+
+    n = similarity.shape[0]
+    totals = similarity.sum(axis=1, keepdims=True)
+
+    # a sentence sharing no words with others links to every sentence
+    transitions = np.divide(similarity, totals, out=np.full_like(similarity, 1 / n), where=totals > 0)
+
+    scores = np.full(n, 1 / n)
+    for _ in range(MAX_ITERATIONS):
+        updated = (1 - DAMPING) / n + DAMPING * (transitions.T @ scores)
+        if np.abs(updated - scores).sum() < TOLERANCE:
+            return updated
+        scores = updated
+
+    return scores
+
+
+def centroid_scores(vectors) -> np.ndarray:
+    """
+    Cosine similarity of every sentence to the mean of all sentences
+    """
+    centroid = np.asarray(vectors.mean(axis=0)).ravel()
+    norm = np.linalg.norm(centroid)
+
+    return vectors @ (centroid / norm) if norm else np.zeros(vectors.shape[0])
+
+
+def extract_summary(text: str, max_sentences: int) -> str:
+    sentences = preprocess_text(text)
+    if len(sentences) <= max_sentences:
+        return ' '.join(sentences)
+
+    vectors = sentence_vectors(sentences)
+    if len(sentences) <= TEXTRANK_MAX_SENTENCES:
+        scores = textrank_scores(vectors)
+    else:
+        scores = centroid_scores(vectors)
+
+    # stable sort keeps the earlier of equally scored sentences
+    best = np.sort(np.argsort(-scores, kind='stable')[:max_sentences])
+
+    return ' '.join(sentences[i] for i in best)
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, String, Index
 from pydantic import ConfigDict
 from typing import Optional
 
@@ -12,6 +12,11 @@ class Summary(Base):
     Database model for results of summarization
     """
     __tablename__ = 'summaries'
+    __table_args__ = (
+        Index('ix_summaries_user_id_text_digest', 'user_id', 'text_digest', unique=True),
+        # keyset pagination of user's rows
+        Index('ix_summaries_user_id_id', 'user_id', 'id'),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     
@@ -19,6 +24,9 @@ class Summary(Base):
     
     # Just TEXT field to store files contents, parsed html, plain text 
     source_text: Mapped[str]
+
+    # sha256 of `source_text`, maintained by BaseDA, used to find the same text
+    text_digest: Mapped[str] = mapped_column(String(64))
     
     # Also a TEXT filed for processed `source_text`
     summarized_text: Mapped[str]
@@ -1,66 +1,215 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+from typing import Literal
 
-from fastapi_limiter.depends import RateLimiter
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.summaries.schemas import SummaryPublic, SummaryPost, SummaryUpdate, SummaryDelete
-from app.summaries.summarize import summarize
+from app.limiter import CostLimiter
+
+from app.summaries.schemas import (
+    SummaryPublic, 
+    SummaryPost, 
+    SummaryUpdate, 
+    SummaryDelete,
+    SummaryListItem,
+    SummaryPage,
+)
+from app.summaries.summarize import SUMMARIZERS, stream_summary
+from app.summaries.cache import summary_cache, summarize_cached
 from app.summaries.data_access import SummaryDA
-from app.redis import get_storage
+from app.summaries import tasks
+from app.database import get_session
+from app.users.dependencies import get_current_user
+from app.jobs import JobSubmitted, JobPublic, submit_job, get_job
 
 
 router = APIRouter(prefix='/summary', tags=['Summaries'])
 
-storage = get_storage(SummaryPublic, prefix='summary')
-
 
 @router.get('/text/{id}')
 async def get_summary(id: int) -> SummaryPublic:
-    instance = await storage.get(str(id))
-    if instance:
-        return instance
-    
+    # read through the row cache of SummaryDA
     instance = await SummaryDA.get(id=id)
     if instance:
-        _ = await storage.store(str(id), SummaryPublic.model_validate(instance.to_dict()))
         return instance
     
     raise HTTPException(status.HTTP_404_NOT_FOUND)
 
 
-@router.post('/text', dependencies=[Depends(RateLimiter(times=1, seconds=1))])
+@router.get('/texts', response_model_exclude_none=True)
+async def list_summaries(
+    after: int | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    fields: list[Literal['user_id', 'source_text', 'summarized_text']] | None = Query(None),
+    user = Depends(get_current_user),
+) -> SummaryPage:
+    """
+    User's summaries ordered by id, page by page. 
+    `fields` picks what to return besides id (everything by default)
+    """
+    if not user:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='You are not authorized')
+
+    fields = fields or list(SummaryListItem.model_fields.keys() - {'id'})
+
+    # one extra row tells whether there is a next page
+    instances = await SummaryDA.filter_page(after, limit + 1, fields, user_id=user.id)
+    items = [
+        SummaryListItem(id=instance.id, **{field: getattr(instance, field) for field in fields})
+        for instance in instances[:limit]
+    ]
+    next_after = items[-1].id if len(instances) > limit else None
+
+    return SummaryPage(items=items, next_after=next_after)
+
+
+@router.post('/text', dependencies=[Depends(CostLimiter('summary'))])
 async def make_summary(request_body: SummaryPost) -> SummaryPublic:
-    instance = await SummaryDA.get(**request_body.model_dump())
-    if instance:
-        return instance
+    """
+    Summarizes text (if it was not summarized before).
+    Only LLM summaries are saved, extractive ones are cheaper to make again
+    """
+    # `mode` is not a column
+    values = request_body.model_dump(exclude={'mode'})
+    saved = request_body.user_id is not None and request_body.mode == 'llm'
 
-    summarized_text = summarize(request_body.source_text)
-    values = request_body.model_dump() | {'summarized_text': summarized_text}    
+    if saved:
+        instance = await SummaryDA.get(**values)
+        if instance:
+            return instance
 
-    if request_body.user_id:
-        new_instance = await SummaryDA.create(**values)
+    # the same text may have been summarized for someone else
+    summarized_text = await summarize_cached(request_body.source_text, request_body.mode)
+    values = values | {'summarized_text': summarized_text}    
+
+    if saved:
+        # the same text may have been saved by a concurrent request meanwhile
+        new_instance = await SummaryDA.get_or_create(**values)
         return new_instance
     
     return values # type: ignore
 
 
-@router.put('/text', dependencies=[Depends(RateLimiter(times=1, seconds=1))])
-async def update_summary(request_body: SummaryUpdate) -> SummaryUpdate:
-    filter_by = {'id': request_body.id}
-    is_updated = await SummaryDA.update(
-        filter_by, source_text=request_body.updated_text
+@router.post('/text/stream', dependencies=[Depends(CostLimiter('summary'))])
+async def stream_summary_text(
+    request_body: SummaryPost,
+    format: Literal['ndjson', 'sse'] = 'ndjson',
+) -> StreamingResponse:
+    """
+    Streaming variant of `POST /summary/text`.
+    Pieces of the summary are sent as they are generated (NDJSON lines or 
+    server-sent events), the last message carries id of the saved summary
+    """
+    # `mode` is not a column
+    values = request_body.model_dump(exclude={'mode'})
+    saved = request_body.user_id is not None and request_body.mode == 'llm'
+
+    instance = None
+    if saved:
+        instance = await SummaryDA.get(**values)
+
+    def encode(data: str, event: str | None = None) -> str:
+        if format == 'ndjson':
+            return data + '\n'
+
+        return (f'event: {event}\n' if event else '') + f'data: {data}\n\n'
+
+    async def generate():
+        if instance is not None:
+            yield encode(json.dumps({'text': instance.summarized_text}))
+            yield encode(json.dumps({'id': instance.id}), event='done')
+            return
+
+        source_text, mode = request_body.source_text, request_body.mode
+        cacheable = SUMMARIZERS[mode].cacheable
+
+        summarized_text = await summary_cache.get(source_text) if cacheable else None
+
+        if summarized_text is not None:
+            yield encode(json.dumps({'text': summarized_text}))
+        else:
+            parts = []
+            async for part in stream_summary(source_text, mode):
+                parts.append(part)
+                yield encode(json.dumps({'text': part}))
+
+            # saved only when the whole summary was generated
+            summarized_text = ''.join(parts)
+            if cacheable:
+                await summary_cache.set(source_text, summarized_text)
+
+        new_instance = None
+        if saved:
+            new_instance = await SummaryDA.get_or_create(
+                **values | {'summarized_text': summarized_text}
+            )
+
+        yield encode(json.dumps({'id': new_instance.id if new_instance else None}), event='done')
+
+    media_type = 'application/x-ndjson' if format == 'ndjson' else 'text/event-stream'
+    return StreamingResponse(generate(), media_type=media_type)
+
+
+@router.post(
+    '/jobs',
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(CostLimiter('summary'))],
+)
+async def submit_summary_job(request_body: SummaryPost) -> JobSubmitted:
+    """
+    Queues summarization of a text for Celery workers and returns at once,
+    result is fetched with `GET /summary/jobs/{job_id}`
+    """
+    # the job returns the saved summary of `user_id`, so only that user can see it
+    return await submit_job(
+        tasks.make_summary, 
+        request_body.source_text, 
+        request_body.user_id, 
+        request_body.mode,
+        owner_id=request_body.user_id,
     )
+
+
+@router.get('/jobs/{job_id}')
+async def get_summary_job(
+    job_id: str, 
+    wait: float = 0,
+    user = Depends(get_current_user),
+) -> JobPublic:
+    """
+    Status of a background summarization, waits up to `wait` seconds
+    for it to finish (long poll)
+    """
+    return await get_job(job_id, user.id if user else None, wait)
+
+
+@router.put('/text', dependencies=[Depends(CostLimiter('summary-update'))])
+async def update_summary(
+    request_body: SummaryUpdate,
+    session: AsyncSession = Depends(get_session, scope='function'),
+) -> SummaryPublic:
+    try:
+        updated = await SummaryDA.update(
+            {'id': request_body.id}, session=session, source_text=request_body.updated_text
+        )
+    except IntegrityError:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail='This text was already summarized')
     
-    if is_updated:
-        instance = await SummaryDA.get(**filter_by)
-        return instance # type: ignore
+    if updated:
+        return updated[0]
     
     raise HTTPException(status.HTTP_304_NOT_MODIFIED)
 
 
-@router.delete('/text', dependencies=[Depends(RateLimiter(times=1, seconds=1))])
-async def delete_summary(request_body: SummaryDelete) -> dict:
-    is_deleted = await SummaryDA.delete(**request_body.to_dict())
-    if is_deleted:
+@router.delete('/text', dependencies=[Depends(CostLimiter('summary-delete'))])
+async def delete_summary(
+    request_body: SummaryDelete,
+    session: AsyncSession = Depends(get_session, scope='function'),
+) -> dict:
+    deleted_ids = await SummaryDA.delete(session=session, **request_body.to_dict())
+    if deleted_ids:
         return {'message': 'ok'}
     
     raise HTTPException(status.HTTP_404_NOT_FOUND)
@@ -1,6 +1,13 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
 
+# `llm` summaries are generated by the model (seconds), `extractive` ones
+# are made of the most central sentences of the text (milliseconds)
+SummaryMode = Literal['llm', 'extractive']
+
+
 class SummaryPublic(BaseModel):
     """
     Response schema
@@ -11,12 +18,32 @@ class SummaryPublic(BaseModel):
     summarized_text: str
 
 
+class SummaryListItem(BaseModel):
+    """
+    Summary in a list, fields that were not requested are left out
+    """
+    id: int
+    user_id: int | None = None
+    source_text: str | None = None
+    summarized_text: str | None = None
+
+
+class SummaryPage(BaseModel):
+    """
+    One page of user's summaries, the next one is requested 
+    with `after=next_after` (None when this page is the last)
+    """
+    items: list[SummaryListItem]
+    next_after: int | None = None
+
+
 class SummaryPost(BaseModel):
     """
     Defines POST request schema
     """
     user_id: int | None = None
     source_text: str
+    mode: SummaryMode = 'llm'
 
 
 class SummaryUpdate(BaseModel):
@@ -1,20 +1,233 @@
-from ollama import chat
+import asyncio
+from typing import AsyncIterator, Protocol
 
+from ollama import AsyncClient
 
-def summarize(text: str):
+from app.sentiments.analyzer import preprocess_text
+from app.summaries.extractive import extract_summary
+from app.config import settings
+
+
+PROMPT = 'Summarize the following text by outlining key ideas. ' \
+         'Do not write your opinion, ' \
+         'only use what was provided in the text \n\n'
+
+REDUCE_PROMPT = 'The following are summaries of consecutive parts of one text. ' \
+                'Combine them into a single summary of the whole text by outlining key ideas. ' \
+                'Do not write your opinion, ' \
+                'only use what was provided in the summaries \n\n'
+
+# part of summary cache keys, has to be increased whenever prompts
+# or the way texts are chunked change, so old summaries are not reused
+PROMPT_VERSION = 1
+
+# rough size of a token, there is no tokenizer of the model here
+# (about 4 characters for English, 3 for Russian, the smaller is taken)
+CHARS_PER_TOKEN = 3
+
+# partial summaries are summarized again until they fit one chunk,
+# but not more times than this (e.g. if the model does not shorten them)
+MAX_REDUCE_ROUNDS = 3
+
+# (event loop, client, semaphore), Celery tasks run every coroutine in a new loop
+# and connections of a client can not outlive its loop
+_client: tuple[asyncio.AbstractEventLoop, AsyncClient, asyncio.Semaphore] | None = None
+
+
+def get_client() -> tuple[AsyncClient, asyncio.Semaphore]:
+    """
+    Ollama client of the running event loop and the semaphore
+    that caps concurrent generations at OLLAMA_CONCURRENCY
+    """
+    global _client
+
+    loop = asyncio.get_running_loop()
+    if _client is None or _client[0] is not loop:
+        _client = (
+            loop,
+            AsyncClient(host=settings.OLLAMA_HOST, timeout=settings.OLLAMA_TIMEOUT),
+            asyncio.Semaphore(settings.OLLAMA_CONCURRENCY),
+        )
+
+    return _client[1], _client[2]
+
+
+def get_messages(text: str, prompt: str = PROMPT) -> list[dict]:
+    return [{
+        'role': 'user',
+        'content': prompt + text,
+    }]
+
+
+def count_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def split_chunks(text: str, max_tokens: int) -> list[str]:
     """
-    Makes request to LLM (gemma3) to process text
+    Packs sentences of `text` (razdel, as `preprocess_text` splits them)
+    into chunks of at most `max_tokens`. A sentence longer than that 
+    is split between words (and words between characters)
     """
-    initial_prompt = 'Summarize the following text by outlining key ideas. ' \
-                     'Do not write your opinion, ' \
-                     'only use what was provided in the text \n\n'
-    model_response = chat(
-        model='gemma3', 
-        messages=[{
-            'role': 'user',
-            'content': initial_prompt + text,
-        }],
-    )
-    content = model_response['message']['content']
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    pieces = []
+    for sentence in preprocess_text(text):
+        if count_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+
+        words = [
+            word[i:i + max_chars] 
+            for word in sentence.split(' ') for i in range(0, len(word), max_chars)
+        ]
+
+        piece = []
+        for word in words:
+            if piece and count_tokens(' '.join(piece + [word])) > max_tokens:
+                pieces.append(' '.join(piece))
+                piece = []
+            piece.append(word)
+        pieces.append(' '.join(piece))
+
+    chunks, chunk, size = [], [], 0
+    for piece in pieces:
+        # +1 for the space that joins pieces
+        piece_size = count_tokens(piece) + 1
+
+        if chunk and size + piece_size > max_tokens:
+            chunks.append(' '.join(chunk))
+            chunk, size = [], 0
+
+        chunk.append(piece)
+        size += piece_size
+
+    if chunk:
+        chunks.append(' '.join(chunk))
+
+    return chunks or ['']
+
+
+async def generate(text: str, prompt: str = PROMPT) -> str:
+    client, semaphore = get_client()
+
+    async with semaphore:
+        model_response = await client.chat(
+            model=settings.OLLAMA_MODEL, 
+            messages=get_messages(text, prompt),
+        )
+
+    return model_response['message']['content']
+
+
+async def reduce_input(text: str) -> tuple[str, str]:
+    """
+    Map step of summarization: chunks of a long text are summarized concurrently,
+    partial summaries are chunked and summarized again until they fit one chunk.
+    Returns (prompt, text) of the final generation
+    """
+    max_tokens = settings.SUMMARY_CHUNK_TOKENS
+    if count_tokens(text) <= max_tokens:
+        return PROMPT, text
+
+    chunks = split_chunks(text, max_tokens)
+    prompt = PROMPT
+    limit = asyncio.Semaphore(settings.SUMMARY_MAP_CONCURRENCY)
+
+    async def map_chunk(chunk: str, prompt: str) -> str:
+        async with limit:
+            return await generate(chunk, prompt)
+
+    for _ in range(MAX_REDUCE_ROUNDS):
+        if len(chunks) == 1:
+            break
 
-    return content
+        partials = await asyncio.gather(*[map_chunk(chunk, prompt) for chunk in chunks])
+        prompt = REDUCE_PROMPT
+        text = '\n\n'.join(partials)
+        chunks = split_chunks(text, max_tokens)
+
+    return prompt, text
+
+
+class Summarizer(Protocol):
+    """
+    Backend of `summarize`, selected by `mode` of a request
+    """
+    # whether summaries are worth keeping in the shared summary cache
+    cacheable: bool
+
+    async def summarize(self, text: str) -> str: ...
+
+    def stream(self, text: str) -> AsyncIterator[str]: ...
+
+
+class LLMSummarizer:
+    """
+    Summaries generated by the Ollama model,
+    long texts are summarized chunk by chunk (see `reduce_input`)
+    """
+    cacheable = True
+
+
+    async def summarize(self, text: str) -> str:
+        prompt, text = await reduce_input(text)
+        return await generate(text, prompt)
+
+
+    async def stream(self, text: str) -> AsyncIterator[str]:
+        prompt, text = await reduce_input(text)
+        client, semaphore = get_client()
+
+        async with semaphore:
+            parts = await client.chat(
+                model=settings.OLLAMA_MODEL, 
+                messages=get_messages(text, prompt),
+                stream=True,
+            )
+
+            async for part in parts:
+                if part['message']['content']:
+                    yield part['message']['content']
+
+
+class ExtractiveSummarizer:
+    """
+    The most central sentences of the text (see `app.summaries.extractive`),
+    takes milliseconds, so results are not cached
+    """
+    cacheable = False
+
+
+    def __init__(self, max_sentences: int):
+        self.max_sentences = max_sentences
+
+
+    async def summarize(self, text: str) -> str:
+        # long texts take a while to split and score, the event loop is not blocked meanwhile
+        return await asyncio.to_thread(extract_summary, text, self.max_sentences)
+
+
+    async def stream(self, text: str) -> AsyncIterator[str]:
+        yield await self.summarize(text)
+
+
+SUMMARIZERS: dict[str, Summarizer] = {
+    'llm': LLMSummarizer(),
+    'extractive': ExtractiveSummarizer(settings.SUMMARY_EXTRACTIVE_SENTENCES),
+}
+
+
+async def summarize(text: str, mode: str = 'llm') -> str:
+    """
+    Summarizes text with the backend of `mode`, LLM (gemma3 by default) unless told otherwise
+    """
+    return await SUMMARIZERS[mode].summarize(text)
+
+
+async def stream_summary(text: str, mode: str = 'llm') -> AsyncIterator[str]:
+    """
+    Same as `summarize`, but yields pieces of the summary as they are generated
+    """
+    async for part in SUMMARIZERS[mode].stream(text):
+        yield part
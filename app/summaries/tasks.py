@@ -0,0 +1,27 @@
+from app.worker import celery_app, run_async
+from app.summaries.data_access import SummaryDA
+from app.summaries.cache import summarize_cached
+
+
+@celery_app.task(name='summaries.summarize')
+def make_summary(source_text: str, user_id: int | None = None, mode: str = 'llm') -> dict:
+    """
+    Background version of `POST /summary/text`
+    """
+    saved = user_id is not None and mode == 'llm'
+
+    if saved:
+        instance = run_async(SummaryDA.get(user_id=user_id, source_text=source_text))
+        if instance:
+            return {'id': instance.id, 'user_id': user_id, 'summarized_text': instance.summarized_text}
+
+    summarized_text = run_async(summarize_cached(source_text, mode))
+
+    if not saved:
+        return {'id': None, 'user_id': user_id, 'summarized_text': summarized_text}
+
+    instance = run_async(SummaryDA.get_or_create(
+        user_id=user_id, source_text=source_text, summarized_text=summarized_text
+    ))
+
+    return {'id': instance.id, 'user_id': user_id, 'summarized_text': summarized_text}
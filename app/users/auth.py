@@ -1,22 +1,47 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 from jose import jwt
 from datetime import datetime, timezone, timedelta
 
 from pydantic import EmailStr
 
-from app.config import get_auth_data
+from app.config import get_auth_data, settings
 from app.users.data_access import UserDA
-
-
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
-
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+from app.logs import logger
+
+
+# hashes with less rounds than configured are rehashed on successful login
+pwd_context = CryptContext(
+    schemes=['bcrypt'],
+    deprecated='auto',
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt takes 100+ ms of CPU per call, it must not run on the event loop;
+# the number of threads caps how many hashes are computed at once
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_CONCURRENCY,
+    thread_name_prefix='password-hash',
+)
+
+
+async def get_password_hash(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Returns whether password is correct and, if the hash is outdated
+    (e.g. made with less rounds), a new hash of the password
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _hash_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
 
 
 def create_access_token(data: dict) -> str:
@@ -35,8 +60,15 @@ def create_access_token(data: dict) -> str:
 
 async def authenticate_user(email: EmailStr, password: str):
     user = await UserDA.get(email=email)
+    if not user:
+        return None
+
+    is_valid, new_hash = await verify_password(plain_password=password, hashed_password=user.password)
+    if not is_valid:
+        return None
 
-    if user and verify_password(plain_password=password, hashed_password=user.password):
-        return user
+    if new_hash:
+        await UserDA.update({'id': user.id}, password=new_hash)
+        logger.info('Password hash was upgraded', user_id=user.id)
 
-    return None
+    return user
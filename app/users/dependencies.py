@@ -1,3 +1,6 @@
+import time
+from collections import OrderedDict
+
 from fastapi import Request, HTTPException, status, Depends
 from jose import jwt, JWTError
 
@@ -5,7 +8,58 @@ from app.users.data_access import UserDA
 from app.users.schemas import UserPublic
 
 from app.logs import logger
-from app.config import get_auth_data
+from app.config import get_auth_data, settings
+from app.cache import invalidation_hooks, publish_invalidation
+from app.redis import r
+
+
+# claims of `UserPublic` that are put into token when AUTH_TOKEN_CLAIMS is on
+USER_CLAIMS = ('username', 'email', 'is_admin')
+
+# token -> (user, expiration time), most recently used last
+_users_by_token: OrderedDict[str, tuple[UserPublic, float]] = OrderedDict()
+
+
+def _forget(key: str) -> None:
+    if key == '*':
+        _users_by_token.clear()
+        return
+
+    if not key.startswith('user:'):
+        return
+
+    user_id = int(key.removeprefix('user:'))
+    for token, (user, _) in list(_users_by_token.items()):
+        if user.id == user_id:
+            del _users_by_token[token]
+
+
+invalidation_hooks.append(_forget)
+
+
+async def forget_user(user_id: int) -> None:
+    """
+    Drops cached user of every token in this and other workers,
+    must be called when the user is changed or deleted
+    """
+    _forget(f'user:{user_id}')
+    await publish_invalidation(r, f'user:{user_id}')
+
+
+def _remember(token: str, user: UserPublic, expires_at: float | None = None) -> None:
+    """
+    Caches `user` of `token` for AUTH_USER_CACHE_TTL seconds,
+    but no longer than until `expires_at` (`exp` claim of the token)
+    """
+    ttl = settings.AUTH_USER_CACHE_TTL
+    if expires_at is not None:
+        ttl = min(ttl, expires_at - time.time())
+
+    _users_by_token[token] = (user, time.monotonic() + ttl)
+    _users_by_token.move_to_end(token)
+
+    if len(_users_by_token) > settings.AUTH_USER_CACHE_SIZE:
+        _users_by_token.popitem(last=False)
 
 
 def get_token(request: Request) -> str | None:
@@ -22,6 +76,11 @@ async def get_current_user(token: str = Depends(get_token)) -> UserPublic | None
     if not token:
         return None
 
+    cached = _users_by_token.get(token)
+    if cached and cached[1] > time.monotonic():
+        _users_by_token.move_to_end(token)
+        return cached[0]
+
     try:
         auth_data = get_auth_data()
 
@@ -32,10 +91,19 @@ async def get_current_user(token: str = Depends(get_token)) -> UserPublic | None
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='Invalid token or is has expired')
 
     user_id = int(payload['sub'])
+
+    # verified token that carries the whole profile needs no database
+    if settings.AUTH_TOKEN_CLAIMS and all(claim in payload for claim in USER_CLAIMS):
+        return UserPublic(id=user_id, **{claim: payload[claim] for claim in USER_CLAIMS})
+
     user = await UserDA.get(id=user_id)
     if not user:
         logger.debug('User not found after decoding token', user_id=user_id)
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail='User not found')
 
     logger.debug('User was found', user_id=user_id)
+
+    user = UserPublic.model_validate(user)
+    _remember(token, user, payload.get('exp'))
+
     return user
@@ -1,11 +1,15 @@
+from functools import partial
+
 from fastapi import (
     APIRouter, 
     HTTPException, 
     status, 
     Response, 
-    Depends
+    Depends,
+    Query,
 )
-from fastapi_limiter.depends import RateLimiter
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.users.data_access import UserDA
 from app.users.schemas import (
@@ -17,8 +21,11 @@ from app.users.schemas import (
     UserDelete
 )
 from app.users.auth import get_password_hash, create_access_token, authenticate_user
-from app.users.dependencies import get_current_user
+from app.users.dependencies import get_current_user, forget_user, USER_CLAIMS
+from app.database import get_session, after_commit
+from app.limiter import CostLimiter
 from app.logs import logger
+from app.config import settings
 
 
 router = APIRouter(prefix='/user', tags=['Users'])
@@ -27,7 +34,7 @@ router = APIRouter(prefix='/user', tags=['Users'])
 @router.get(
     '/', 
     summary='Gets user profile',
-    dependencies=[Depends(RateLimiter(times=1, seconds=1))],
+    dependencies=[Depends(CostLimiter('user-profile'))],
 )
 async def get_user(user: UserPublic = Depends(get_current_user)) -> UserPublic:
     if user:
@@ -38,29 +45,25 @@ async def get_user(user: UserPublic = Depends(get_current_user)) -> UserPublic:
 @router.post(
     '/signup', 
     summary='Registers user', 
-    dependencies=[Depends(RateLimiter(times=1, seconds=1))],
+    dependencies=[Depends(CostLimiter('user-signup'))],
 )
 async def signup(user_info: UserSignUp) -> UserPublic:
-    username_exists = await UserDA.get(username=user_info.username)
-    if username_exists:
-        logger.debug('Failed attempt to sign up (username exists)', username=user_info.username)
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail='User with this username already exists'
-        )
-
-    email_exists = await UserDA.get(email=user_info.email)
-    if email_exists:
-        logger.debug('Failed attempt to sign up (email exists)', email=user_info.email)
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail='User with this email already exists'
-        )
-
     user_dict = user_info.model_dump()
-    user_dict['password'] = get_password_hash(user_info.password)
-    
-    user = await UserDA.create(**user_dict)
+    user_dict['password'] = await get_password_hash(user_info.password)
+
+    # unique constraints are checked by the insert itself,
+    # which of them has failed is looked up only then
+    try:
+        user = await UserDA.create(**user_dict)
+    except IntegrityError:
+        if await UserDA.get(username=user_info.username):
+            logger.debug('Failed attempt to sign up (username exists)', username=user_info.username)
+            detail = 'User with this username already exists'
+        else:
+            logger.debug('Failed attempt to sign up (email exists)', email=user_info.email)
+            detail = 'User with this email already exists'
+
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
 
     logger.info('User was signed up')
     return user
@@ -69,7 +72,7 @@ async def signup(user_info: UserSignUp) -> UserPublic:
 @router.post(
     '/signin', 
     summary='Logs user in',
-    dependencies=[Depends(RateLimiter(times=1, seconds=1))],
+    dependencies=[Depends(CostLimiter('user-signin'))],
 )
 async def signin(response: Response, user_info: UserSignIn) -> dict:
     user = await authenticate_user(email=user_info.email, password=user_info.password)
@@ -78,7 +81,11 @@ async def signin(response: Response, user_info: UserSignIn) -> dict:
         logger.debug('Failed attemp to sign in', email=user_info.email)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid email or password')
 
-    access_token = create_access_token({'sub': str(user.id)})
+    claims = {'sub': str(user.id)}
+    if settings.AUTH_TOKEN_CLAIMS:
+        claims |= {claim: getattr(user, claim) for claim in USER_CLAIMS}
+
+    access_token = create_access_token(claims)
     response.set_cookie(key='user_access_token', value=access_token, httponly=True, secure=True)
     
     logger.info('User was logged in')
@@ -88,7 +95,7 @@ async def signin(response: Response, user_info: UserSignIn) -> dict:
 @router.post(
     '/logout', 
     summary='Logs user out',
-    dependencies=[Depends(RateLimiter(times=1, seconds=1))],
+    dependencies=[Depends(CostLimiter('user-logout'))],
 )
 async def logout(response: Response) -> dict:
     response.delete_cookie(key='user_access_token')
@@ -99,10 +106,17 @@ async def logout(response: Response) -> dict:
 @router.post(
     '/find', 
     summary='Finds users',
-    dependencies=[Depends(RateLimiter(times=1, seconds=1))],
+    dependencies=[Depends(CostLimiter('user-find'))],
 )
-async def find_users(filter_by: UserFilter) -> list[UserPublic]:
-    users = await UserDA.filter(**filter_by.to_dict())
+async def find_users(
+    filter_by: UserFilter,
+    after: int | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+) -> list[UserPublic]:
+    """
+    At most `limit` users ordered by id, the next page starts after the last id
+    """
+    users = await UserDA.filter_page(after, limit, **filter_by.to_dict())
 
     if not users:
         logger.debug('No users was found', **filter_by.to_dict())
@@ -115,35 +129,56 @@ async def find_users(filter_by: UserFilter) -> list[UserPublic]:
 @router.put(
     '/', 
     summary='Changes user information',
-    dependencies=[Depends(RateLimiter(times=1, seconds=1))],
+    dependencies=[Depends(CostLimiter('user-update'))],
 )
-async def update_user(user_id: int, user_info: UserUpdate) -> UserPublic:
-    check = await UserDA.update(filter_by={'id': user_id}, **user_info.to_dict())
+async def update_user(
+    user_id: int, 
+    user_info: UserUpdate,
+    session: AsyncSession = Depends(get_session, scope='function'),
+) -> UserPublic:
+    try:
+        updated = await UserDA.update(filter_by={'id': user_id}, session=session, **user_info.to_dict())
+    except IntegrityError:
+        logger.debug('Failed to update user information (taken)', user_id=user_id, **user_info.to_dict())
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, 
+            detail='User with this username or email already exists'
+        )
 
-    if not check:
+    if not updated:
         logger.debug('Failed to update user information', user_id=user_id, **user_info.to_dict())
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Error when updating user information')
 
-    user = await UserDA.get(id=user_id)
+    after_commit(session, partial(forget_user, user_id))
 
     logger.debug('Updated user information', user_id=user_id, **user_info.to_dict())
-    return user  # type: ignore
+    return updated[0]
 
 
 @router.delete(
     '/', 
     summary='Deletes user',
-    dependencies=[Depends(RateLimiter(times=1, seconds=1))],
+    dependencies=[Depends(CostLimiter('user-delete'))],
 )
-async def delete_user(user: UserDelete) -> dict:
-    check = await UserDA.delete(**user.to_dict())
+async def delete_user(
+    user: UserDelete,
+    session: AsyncSession = Depends(get_session, scope='function'),
+) -> dict:
+    # empty filter would match every user
+    if not user.to_dict():
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='No user was specified')
+
+    deleted_ids = await UserDA.delete(session=session, **user.to_dict())
 
-    if not check:
+    if not deleted_ids:
         logger.debug('Failed to delete user', **user.to_dict())
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail='Error when deleting user'
         )
 
+    for user_id in deleted_ids:
+        after_commit(session, partial(forget_user, user_id))
+
     logger.debug('User was deleted', **user.to_dict())
     return {'message': 'User was successfully deleted'}
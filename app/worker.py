@@ -0,0 +1,44 @@
+"""
+Celery application for long analyses.
+
+    celery -A app.worker worker --loglevel=info
+"""
+import asyncio
+from typing import Coroutine
+
+from celery import Celery
+
+from app.config import settings, get_redis_url
+from app.database import engine
+from app.redis import r
+
+
+celery_app = Celery(
+    'verityai',
+    broker=get_redis_url(settings.CELERY_BROKER_DB),
+    backend=get_redis_url(settings.CELERY_RESULT_DB),
+    include=['app.sentiments.tasks', 'app.summaries.tasks'],
+)
+celery_app.conf.update(
+    task_track_started=True,
+    result_expires=settings.CELERY_RESULT_TTL,
+    # jobs are long, a worker should not reserve jobs it can not start yet
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+)
+
+
+def run_async(coroutine: Coroutine):
+    """
+    Runs data access coroutine from a (sync) task.
+    Every task gets a new event loop, so database and Redis
+    connections of the previous loop are dropped afterwards
+    """
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await engine.dispose()
+            await r.connection_pool.disconnect()
+
+    return asyncio.run(run())
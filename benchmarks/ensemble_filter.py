@@ -0,0 +1,78 @@
+"""
+Compares `GraphCreator.ensemble_filter` with the previous
+`savgol_filter` loop on random series of 10k-1M points.
+
+    python -m benchmarks.ensemble_filter [--legacy-limit N]
+
+The loop costs O(length * window) per window and takes minutes
+past ~30k points, so it is only run up to `--legacy-limit`
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy.signal import savgol_filter
+
+from app.sentiments.analyzer import GraphCreator
+
+
+SIZES = [10_000, 30_000, 100_000, 300_000, 1_000_000]
+
+
+def legacy_ensemble_filter(data: np.ndarray, number_of_filters: int = 100) -> tuple[np.ndarray, int]:
+    data_length = len(data)
+
+    start = data_length // 10
+    stop = data_length // 4
+    step = (stop - start) // number_of_filters
+    step = step if step != 0 else 1
+
+    all_filters = 0
+    windows = 0
+
+    for window_length in range(start, stop, step):
+        all_filters += savgol_filter(data, window_length=window_length, polyorder=0)
+        windows += 1
+
+    return all_filters / number_of_filters, windows # type: ignore
+
+
+def measure(function, *args) -> tuple[float, object]:
+    started = time.perf_counter()
+    result = function(*args)
+
+    return time.perf_counter() - started, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--legacy-limit', type=int, default=30_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f'{"points":>10} {"vectorized, s":>14} {"loop, s":>10} {"speedup":>8} {"max diff":>10}')
+
+    for size in SIZES:
+        data = np.cumsum(rng.normal(size=size)) / np.sqrt(size)
+
+        graph = GraphCreator(data) # type: ignore
+        vectorized_time, _ = measure(graph.ensemble_filter)
+
+        if size > args.legacy_limit:
+            print(f'{size:>10} {vectorized_time:>14.4f} {"-":>10} {"-":>8} {"-":>10}')
+            continue
+
+        legacy_time, (legacy, windows) = measure(legacy_ensemble_filter, data) # type: ignore
+
+        # the loop divides by `number_of_filters` instead of the number of windows
+        legacy = legacy * 100 / windows
+        difference = np.abs(legacy - graph.filtered_data).max()
+
+        print(
+            f'{size:>10} {vectorized_time:>14.4f} {legacy_time:>10.2f} '
+            f'{legacy_time / vectorized_time:>8.0f} {difference:>10.2e}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Measures event loop latency during a burst of password verifications.
+
+    python -m benchmarks.login_storm [--logins 50]
+
+A ticker task asks to be woken up every 10 ms and records how late it is,
+first while passwords are verified on the event loop (as before),
+then while they are verified through `app.users.auth.verify_password`
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.users.auth import pwd_context, get_password_hash, verify_password
+
+
+TICK = 0.01
+
+
+async def ticker(lags: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def storm(verify, hashed: str, logins: int) -> tuple[float, list[float]]:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    ticking = asyncio.create_task(ticker(lags, stop))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[verify('correct horse battery', hashed) for _ in range(logins)])
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticking
+
+    return elapsed, lags
+
+
+async def blocking_verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+async def main(logins: int) -> None:
+    hashed = await get_password_hash('correct horse battery')
+    print(f'{"mode":>10} {"total, s":>9} {"lag p50, ms":>12} {"lag p99, ms":>12} {"lag max, ms":>12}')
+
+    for mode, verify in (('blocking', blocking_verify), ('offloaded', verify_password)):
+        elapsed, lags = await storm(verify, hashed, logins)
+        lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+        p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+
+        print(
+            f'{mode:>10} {elapsed:>9.2f} {statistics.median(lags_ms):>12.1f} '
+            f'{p99:>12.1f} {lags_ms[-1]:>12.1f}'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=50)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.logins))
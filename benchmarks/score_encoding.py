@@ -0,0 +1,43 @@
+"""
+Compares sizes of a sentiment score array in every storage format.
+
+    python -m benchmarks.score_encoding
+
+`float8[]` is the Postgres array payload (24 bytes header + 8 per value),
+`pydantic JSON` is what the Redis cache held before (`SentimentPublic` scores only)
+"""
+import json
+import sys
+
+import numpy as np
+
+from app.sentiments.codec import encode_scores, decode_scores
+
+
+SIZES = [100, 1_000, 10_000]
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    print(f'{"sentences":>10} {"format":>14} {"bytes":>10} {"ratio":>6} {"max error":>10}')
+
+    for size in SIZES:
+        scores = np.tanh(rng.normal(size=size)).tolist()
+        baseline = 24 + 8 * size
+
+        formats = {
+            'float8[]': (baseline, 0.0),
+            'pydantic JSON': (len(json.dumps(scores)), 0.0),
+            'python list': (sys.getsizeof(scores) + sum(sys.getsizeof(s) for s in scores), 0.0),
+        }
+        for encoding in ('float32', 'int8'):
+            packed = encode_scores(scores, encoding)
+            error = np.abs(np.array(decode_scores(packed)) - scores).max()
+            formats[encoding] = (len(packed), error)
+
+        for name, (size_bytes, error) in formats.items():
+            print(f'{size:>10} {name:>14} {size_bytes:>10} {baseline / size_bytes:>6.1f} {error:>10.1e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Runs summaries against a fake Ollama server to show event loop latency
+and time to the first streamed piece.
+
+    OLLAMA_HOST=http://127.0.0.1:11500 python -m benchmarks.summary_streaming [--requests 8]
+
+The fake server (started here, on the port of OLLAMA_HOST) answers `/api/chat`
+with `WORDS` pieces, one every `DELAY` seconds, like a model generating tokens.
+`blocking` calls the synchronous `ollama.chat` on the event loop (as before),
+`async` uses `app.summaries.summarize.summarize`, `stream` uses `stream_summary`
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import ollama
+
+from app.summaries.summarize import summarize, stream_summary, get_messages
+from app.config import settings
+
+
+WORDS = 20
+DELAY = 0.02
+TICK = 0.01
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+        def part(content: str, done: bool) -> bytes:
+            message = {'role': 'assistant', 'content': content}
+            return json.dumps({'model': body['model'], 'message': message, 'done': done}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        if not body.get('stream'):
+            time.sleep(WORDS * DELAY)
+            self.wfile.write(part('word ' * WORDS, True))
+            return
+
+        for _ in range(WORDS):
+            time.sleep(DELAY)
+            self.wfile.write(part('word ', False) + b'\n')
+            self.wfile.flush()
+
+        self.wfile.write(part('', True) + b'\n')
+
+
+    def log_message(self, *args):
+        pass
+
+
+async def ticker(lags: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def blocking(text: str) -> float:
+    started = time.perf_counter()
+    ollama.Client(host=settings.OLLAMA_HOST).chat(model=settings.OLLAMA_MODEL, messages=get_messages(text))
+    return time.perf_counter() - started
+
+
+async def non_blocking(text: str) -> float:
+    started = time.perf_counter()
+    await summarize(text)
+    return time.perf_counter() - started
+
+
+async def streaming(text: str) -> float:
+    started = time.perf_counter()
+    first = None
+
+    async for _ in stream_summary(text):
+        if first is None:
+            first = time.perf_counter() - started
+
+    return first # type: ignore
+
+
+async def main(requests: int) -> None:
+    print(f'{"mode":>10} {"total, s":>9} {"first piece p50, s":>19} {"lag p50, ms":>12} {"lag max, ms":>12}')
+
+    for mode, run in (('blocking', blocking), ('async', non_blocking), ('stream', streaming)):
+        lags: list[float] = []
+        stop = asyncio.Event()
+        ticking = asyncio.create_task(ticker(lags, stop))
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*[run('some long text') for _ in range(requests)])
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await ticking
+
+        lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+        print(
+            f'{mode:>10} {elapsed:>9.2f} {statistics.median(latencies):>19.2f} '
+            f'{statistics.median(lags_ms):>12.1f} {lags_ms[-1]:>12.1f}'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=8)
+    args = parser.parse_args()
+
+    address = urlparse(settings.OLLAMA_HOST)
+    server = ThreadingHTTPServer((address.hostname, address.port), FakeOllama) # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        asyncio.run(main(args.requests))
+    finally:
+        server.shutdown()
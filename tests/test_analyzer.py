@@ -0,0 +1,62 @@
+import pytest
+
+from app.sentiments.analyzer import SentimentAnalyzer, preprocess_text, preprocess_text_spans
+
+
+# sentences of very different token lengths, so buckets pad them differently
+MIXED_TEXT = (
+    'Да. Отличный сервис, всем советую! '
+    'Ужасно. '
+    'Доставка задержалась на две недели, курьер не отвечал на звонки, '
+    'а когда всё же приехал, коробка оказалась помятой и половины заказа не было. '
+    'Нормально, но могло быть и лучше. '
+    'Спасибо!'
+)
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    try:
+        return SentimentAnalyzer()
+    except Exception as e:
+        pytest.skip(f'sentiment model is not available: {e}')
+
+
+def test_spans_match_preprocess_text():
+    raw_text = '  Первое   предложение.\n\nВторое,\tс пробелами!  Третье? '
+    spans = preprocess_text_spans(raw_text)
+
+    assert [text for _, _, text in spans] == preprocess_text(raw_text)
+
+    # every span points at the sentence in the raw text (up to whitespace)
+    for start, stop, text in spans:
+        assert raw_text[start:stop].split() == text.split()
+
+
+def test_spans_of_empty_text():
+    for raw_text in ('', ' ', '\n\t '):
+        spans = preprocess_text_spans(raw_text)
+
+        assert [text for _, _, text in spans] == preprocess_text(raw_text)
+        assert all(start == stop for start, stop, _ in spans)
+
+
+def test_batched_scores_match_one_by_one(analyzer):
+    expected = analyzer.estimate_sentiment(MIXED_TEXT)
+
+    # small buckets make several forward passes with different padding
+    for bucket_size in (1, 2, 32):
+        scores = analyzer.estimate_sentiment_batched(MIXED_TEXT, bucket_size=bucket_size)
+        assert scores == pytest.approx(expected, abs=1e-4)
+
+
+def test_score_sentences_keeps_order(analyzer):
+    sentences = preprocess_text(MIXED_TEXT)
+    expected = analyzer.estimate_sentiment(MIXED_TEXT)
+
+    assert analyzer.score_sentences(sentences, bucket_size=2) == pytest.approx(expected, abs=1e-4)
+
+
+def test_score_no_sentences(analyzer):
+    assert analyzer.score_sentences([]) == []
+    assert analyzer.estimate_sentiment_batched('') == []